@@ -1,13 +1,23 @@
 import os
 import json
 import logging
+import sqlite3
 import threading
 import webbrowser
 import re # For parsing Plaid ID from notes
 from datetime import datetime, date # Ensure date is imported
 import datetime as dt
 import decimal
+import sys
 import time # For retry delay
+import glob # For pruning old profile reports
+import queue # For handing log lines from worker threads to the GUI
+import uuid # For Plaid Link session ids
+import random # For scheduler jitter
+import hmac # For constant-time Link API token checks
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from contextlib import contextmanager
 
 import tkinter as tk
 from tkinter import ttk
@@ -27,14 +37,27 @@ from plaid.model.link_token_create_request import LinkTokenCreateRequest
 from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
 from plaid.model.products import Products
 from plaid.model.country_code import CountryCode
+from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
 
 # Flask for handling Plaid Link callback
 from flask import Flask, request, jsonify, render_template_string
 
+# Production WSGI server for the Plaid Link service (required; Flask's dev server is not used)
+from waitress import serve as waitress_serve
+
+# Optional fast JSON decoder for raw Plaid responses; stdlib json is the fallback
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
+
 # actualpy for Actual Budget
 from actual import Actual
 # Corrected imports based on previous errors
 from actual.queries import create_account, create_transaction, get_account, get_transactions
+from actual.database import Transactions
 
 # ------------------------------------------------------------------------------
 # 1. Load environment variables
@@ -48,17 +71,44 @@ ACTUAL_PASSWORD = os.getenv("ACTUAL_PASSWORD", "")
 ACTUAL_BUDGET_NAME = os.getenv("ACTUAL_BUDGET_NAME", "")
 ACTUAL_ACCOUNT_NAME = os.getenv("ACTUAL_ACCOUNT_NAME", "")
 ACTUAL_SERVER_URL = os.getenv("ACTUAL_SERVER_URL", "http://localhost:5006")
+ACTUAL_TARGETS_FILE = os.getenv("ACTUAL_TARGETS_FILE", "actual_targets.json")
+PLAID_ACCOUNT_ID = os.getenv("PLAID_ACCOUNT_ID", "") # Plaid account mirrored by the GUI target; blank = all accounts on the item
+BALANCE_DRIFT_THRESHOLD = decimal.Decimal(os.getenv("BALANCE_DRIFT_THRESHOLD", "1.00"))
+LINK_SERVER_HOST = os.getenv("LINK_SERVER_HOST", "localhost")
+LINK_SERVER_PORT = int(os.getenv("LINK_SERVER_PORT", "5001"))
+LINK_SERVER_THREADS = int(os.getenv("LINK_SERVER_THREADS", "8"))
+LINK_EXCHANGE_WORKERS = int(os.getenv("LINK_EXCHANGE_WORKERS", "8"))
+LINK_API_TOKEN = os.getenv("LINK_API_TOKEN", "") # Bearer token for POST /link/session; blank disables the endpoint
+PLAID_POOL_SIZE = int(os.getenv("PLAID_POOL_SIZE", "16"))
+SYNC_PROFILE = os.getenv("SYNC_PROFILE", "").strip().lower() in ("1", "true", "yes", "on")
+SYNC_PROFILE_KEEP = int(os.getenv("SYNC_PROFILE_KEEP", "10"))
+RUN_HISTORY_KEEP = int(os.getenv("RUN_HISTORY_KEEP", "500")) # Newest runs kept per item, with their timings and reconciliations
+SYNC_PROFILE_INTERVAL_MS = float(os.getenv("SYNC_PROFILE_INTERVAL_MS", "5"))
 
 # Global variables for Plaid Link flow
 global_access_token = PLAID_ACCESS_TOKEN
-global_link_token = None
 flask_thread = None
 sync_after_id = None
 
 # Constants
 PLAID_ID_NOTE_PREFIX = "plaid_id:"
-STATE_FILE = "sync_state.json"
+STATE_FILE = "sync_state.db" # SQLite state store (WAL mode); holds Plaid access tokens, so it is kept owner-only (0600)
+LEGACY_STATE_FILE = "sync_state.json" # Imported into STATE_FILE on first start
 RETRY_DELAY_SECONDS = 10 # Delay before retrying Plaid pagination error
+PRIMARY_TARGET_NAME = "primary" # Actual target configured through the GUI fields
+PLAID_LIABILITY_TYPES = ("credit", "loan") # Plaid reports these balances as positive amounts owed
+ACTUAL_TARGET_KEYS = ("name", "server_url", "password", "budget", "account")
+LINK_SESSION_TTL_SECONDS = 4 * 3600 # Plaid link tokens expire after 4 hours
+PRIMARY_ITEM_KEY = "primary" # Plaid item configured through the GUI access token
+SCHEDULER_TICK_SECONDS = 30 # Longest gap between checks for due items
+SCHEDULE_JITTER_FRACTION = 0.1 # Next runs are spread by up to +/-10% of the interval...
+SCHEDULE_MAX_JITTER_SECONDS = 15 * 60 # ...capped at 15 minutes
+STARTUP_SPREAD_SECONDS = 60 # Items with no schedule yet start within this window
+BACKOFF_BASE_SECONDS = 5 * 60 # First retry delay after a failed run; doubles per failure up to the interval
+PENDING_BATCH_WARN = 10 # Warn once a target has this many unapplied batches queued...
+PENDING_BATCH_LIMIT = 100 # ...and replace the queue with a full-history backfill at this many
+PROFILE_REPORT_PREFIX = "sync_profile_"
+PROFILE_TOP_N = 25 # Functions listed in the text summary of each profile report
 
 # ------------------------------------------------------------------------------
 # 2. Set up logging
@@ -69,7 +119,7 @@ formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
 
 # File Handler
 try:
-    log_filename = STATE_FILE.replace(".json", ".log")
+    log_filename = os.path.splitext(STATE_FILE)[0] + ".log"
     file_handler = logging.FileHandler(log_filename)
     file_handler.setLevel(logging.INFO)
     file_handler.setFormatter(formatter)
@@ -84,7 +134,509 @@ console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
 # ------------------------------------------------------------------------------
-# 3. Set up main Tkinter GUI
+# 3. Plaid response decoding (benchmark: bench_decode.py)
+# ------------------------------------------------------------------------------
+# Only these transaction fields are read by process_plaid_updates/format_note_with_plaid_id
+SLIM_TXN_FIELDS = ("transaction_id", "account_id", "date", "amount", "name", "merchant_name", "category")
+
+def slim_transaction(txn):
+    """Reduces a raw Plaid transaction dict to the fields the sync uses."""
+    return {field: txn.get(field) for field in SLIM_TXN_FIELDS}
+
+def decode_transactions_sync_page(raw_body):
+    """
+    Parses a raw /transactions/sync response body into compact records, skipping
+    the OpenAPI model layer. Dates stay as 'YYYY-MM-DD' strings, which the
+    update loops already handle.
+    """
+    res = _json_loads(raw_body)
+    return {
+        "added": [slim_transaction(t) for t in res.get("added") or []],
+        "modified": [slim_transaction(t) for t in res.get("modified") or []],
+        "removed": [{"transaction_id": r.get("transaction_id"), "account_id": r.get("account_id")} for r in res.get("removed") or []],
+        "accounts": [{"account_id": a.get("account_id"), "type": a.get("type"),
+                      "current": (a.get("balances") or {}).get("current")} for a in res.get("accounts") or []],
+        "has_more": res.get("has_more", False),
+        "next_cursor": res.get("next_cursor"),
+    }
+
+# ------------------------------------------------------------------------------
+# 4. Per-cycle profiling (opt-in via SYNC_PROFILE or the GUI checkbox)
+# ------------------------------------------------------------------------------
+active_profiler = None
+
+class CycleProfiler:
+    """
+    Sampling profiler for one sync cycle. A background thread periodically
+    captures the stacks of the sync thread and of any worker thread inside a
+    section, prefixed with their open sections, so reports show where time
+    went without editing the code.
+    """
+    def __init__(self, interval_ms=SYNC_PROFILE_INTERVAL_MS):
+        self.interval = max(interval_ms, 1) / 1000.0
+        self.main_thread_id = threading.get_ident()
+        self.thread_sections = {self.main_thread_id: ["sync_cycle"]} # thread id -> open sections
+        self.section_times = {} # name -> [calls, wall seconds, cpu seconds]
+        self._lock = threading.Lock()
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+        self._started = None
+
+    def start(self):
+        self._started = (time.perf_counter(), time.thread_time())
+        self._sampler.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._sampler.join()
+        wall_start, cpu_start = self._started
+        self.section_times["sync_cycle"] = [1, time.perf_counter() - wall_start, time.thread_time() - cpu_start]
+
+    def _sample_loop(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, sections in list(self.thread_sections.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[(tuple(sections), tuple(stack))] += 1
+                self.samples += 1
+
+    @contextmanager
+    def section(self, name):
+        thread_id = threading.get_ident()
+        sections = self.thread_sections.setdefault(thread_id, ["sync_cycle"])
+        sections.append(name)
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                totals = self.section_times.setdefault(name, [0, 0.0, 0.0])
+                totals[0] += 1
+                totals[1] += time.perf_counter() - wall_start
+                totals[2] += time.thread_time() - cpu_start
+            sections.pop()
+            if len(sections) == 1 and thread_id != self.main_thread_id:
+                del self.thread_sections[thread_id] # Stop sampling idle worker threads
+
+    def write_reports(self, base_path):
+        """Writes <base>.collapsed (flame graph input) and <base>.txt (top-N summary)."""
+        with open(base_path + ".collapsed", "w") as f:
+            for (sections, stack), count in self.stacks.most_common():
+                f.write(f"{';'.join(sections + stack)} {count}\n")
+
+        self_samples, total_samples = Counter(), Counter()
+        for (_, stack), count in self.stacks.items():
+            self_samples[stack[-1]] += count
+            for func in set(stack):
+                total_samples[func] += count
+
+        lines = [f"Sync cycle profile, {self.samples} samples every {self.interval * 1000:.1f} ms", "",
+                 "Sections (calls, wall s, cpu s):"]
+        for name, (calls, wall, cpu) in sorted(self.section_times.items(), key=lambda kv: -kv[1][1]):
+            lines.append(f"  {name:<20} {calls:>5} {wall:>10.3f} {cpu:>10.3f}")
+        for title, counter in (("self", self_samples), ("cumulative", total_samples)):
+            lines += ["", f"Top {PROFILE_TOP_N} functions by {title} samples:"]
+            for func, count in counter.most_common(PROFILE_TOP_N):
+                lines.append(f"  {count:>7} {100.0 * count / max(self.samples, 1):6.1f}%  {func}")
+        with open(base_path + ".txt", "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+@contextmanager
+def profile_section(name):
+    """Tags a block of the sync cycle in the active profile; a no-op when profiling is off."""
+    if active_profiler is None:
+        yield
+    else:
+        with active_profiler.section(name):
+            yield
+
+def prune_profile_reports(report_dir, keep):
+    """Deletes all but the newest `keep` profile reports in report_dir."""
+    summaries = sorted(glob.glob(os.path.join(report_dir, f"{PROFILE_REPORT_PREFIX}*.txt")))
+    for old_summary in summaries[:-keep] if keep > 0 else summaries:
+        base_path = old_summary[:-len(".txt")]
+        for path in (old_summary, base_path + ".collapsed"):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.debug(f"Could not remove old profile report '{path}': {e}")
+
+# ------------------------------------------------------------------------------
+# 5. Sync state store (SQLite, WAL mode)
+# ------------------------------------------------------------------------------
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    item_key TEXT PRIMARY KEY,
+    access_token TEXT,
+    client_user_id TEXT,
+    linked_at TEXT,
+    interval_hours REAL
+);
+CREATE TABLE IF NOT EXISTS cursors (
+    item_key TEXT PRIMARY KEY,
+    cursor TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS targets (
+    item_key TEXT NOT NULL,
+    target_name TEXT NOT NULL,
+    applied_cursor TEXT,
+    last_success TEXT,
+    last_error TEXT,
+    balance_cache TEXT,
+    reconciliation TEXT,
+    PRIMARY KEY (item_key, target_name)
+);
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_key TEXT NOT NULL,
+    cursor TEXT,
+    payload TEXT NOT NULL,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS pending_batches (
+    item_key TEXT NOT NULL,
+    target_name TEXT NOT NULL,
+    batch_id INTEGER NOT NULL REFERENCES batches(batch_id),
+    PRIMARY KEY (item_key, target_name, batch_id)
+);
+CREATE INDEX IF NOT EXISTS pending_batches_by_batch ON pending_batches(batch_id);
+CREATE TABLE IF NOT EXISTS id_mappings (
+    item_key TEXT NOT NULL,
+    target_name TEXT NOT NULL,
+    plaid_id TEXT NOT NULL,
+    account_id TEXT NOT NULL,
+    actual_id TEXT NOT NULL,
+    updated_at TEXT,
+    PRIMARY KEY (item_key, target_name, plaid_id)
+);
+CREATE TABLE IF NOT EXISTS schedule (
+    item_key TEXT PRIMARY KEY,
+    interval_hours REAL,
+    next_run REAL,
+    last_run REAL,
+    last_status TEXT,
+    failures INTEGER NOT NULL DEFAULT 0,
+    retry_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_key TEXT NOT NULL,
+    manual INTEGER NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    status TEXT,
+    added INTEGER,
+    modified INTEGER,
+    removed INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_by_item ON runs(item_key, run_id);
+CREATE TABLE IF NOT EXISTS reconciliations (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    target_name TEXT NOT NULL,
+    plaid_balance TEXT NOT NULL,
+    actual_balance TEXT NOT NULL,
+    drift TEXT NOT NULL,
+    PRIMARY KEY (run_id, target_name)
+);
+CREATE TABLE IF NOT EXISTS timings (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    section TEXT NOT NULL,
+    wall_seconds REAL NOT NULL,
+    PRIMARY KEY (run_id, section)
+);
+"""
+
+TARGET_STATE_COLUMNS = ("applied_cursor", "last_success", "last_error", "balance_cache", "reconciliation")
+SCHEDULE_COLUMNS = ("interval_hours", "next_run", "last_run", "last_status", "failures", "retry_count")
+TARGET_JSON_COLUMNS = ("balance_cache", "reconciliation")
+
+def restrict_to_owner(file_path):
+    """
+    chmod 0600 a file holding secrets, warning first if group or others could
+    read it. POSIX only; on Windows keep such files in a private directory.
+    """
+    if os.name != "posix" or not os.path.exists(file_path):
+        return
+    try:
+        if os.stat(file_path).st_mode & 0o077:
+            logger.warning(f"'{file_path}' holds secrets but was readable by other users; restricting it to mode 0600.")
+            os.chmod(file_path, 0o600)
+    except OSError as e:
+        logger.warning(f"Could not restrict permissions on '{file_path}': {e}")
+
+def _now_iso():
+    return datetime.now().isoformat(timespec="seconds")
+
+class StateStore:
+    """
+    Embedded SQLite store for cursors, Actual target state, queued batches,
+    Plaid-to-Actual id mappings and run history. Each thread gets its own
+    connection; WAL mode lets readers proceed while one thread writes.
+    Per-item and per-target reads go through primary keys or indexes; the
+    schedule and item-interval reads scan their (one row per item) tables, so
+    they grow with the item count. Run history is capped at RUN_HISTORY_KEEP
+    runs per item.
+
+    The items table holds Plaid access tokens in plaintext, so the database
+    and its -wal/-shm files are restricted to the owner (mode 0600). On
+    Windows this has no effect; keep the file in a private directory there.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        if not os.path.exists(path):
+            # Create it owner-only before SQLite opens it, so the tokens are never world-readable
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        self.restrict_permissions()
+        conn.executescript(STATE_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: transactions are opened explicitly in transaction()
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def restrict_permissions(self):
+        """Restricts the database files to the owner. SQLite creates -wal/-shm with the database's mode."""
+        for file_path in (self.path, self.path + "-wal", self.path + "-shm"):
+            restrict_to_owner(file_path)
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back on error. Concurrent writers wait up to the connection timeout."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            # Also covers a failed COMMIT, so the connection never stays inside a transaction
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    # --- Items & cursors ---
+    def save_item(self, item_key, access_token, client_user_id, interval_hours=None):
+        # A relink without an interval keeps the item's existing one
+        with self.transaction() as conn:
+            conn.execute("INSERT INTO items (item_key, access_token, client_user_id, linked_at, interval_hours) VALUES (?, ?, ?, ?, ?) "
+                         "ON CONFLICT(item_key) DO UPDATE SET access_token=excluded.access_token, "
+                         "client_user_id=excluded.client_user_id, linked_at=excluded.linked_at, "
+                         "interval_hours=COALESCE(excluded.interval_hours, items.interval_hours)",
+                         (item_key, access_token, client_user_id, _now_iso(), interval_hours))
+
+    def get_item_intervals(self):
+        """Returns {item_key: interval_hours or None} for every linked item."""
+        return dict(self._connection().execute("SELECT item_key, interval_hours FROM items").fetchall())
+
+    def get_item_token(self, item_key):
+        row = self._connection().execute("SELECT access_token FROM items WHERE item_key = ?", (item_key,)).fetchone()
+        return row[0] if row else None
+
+    def get_cursor(self, item_key):
+        row = self._connection().execute("SELECT cursor FROM cursors WHERE item_key = ?", (item_key,)).fetchone()
+        return row[0] if row else None
+
+    def record_fetch(self, item_key, new_cursor, batch, target_names, backfill_batch=None, backfill_targets=()):
+        """
+        Atomically saves the new cursor and queues the fetched batch once for each
+        named target, plus an optional full-history batch for targets being backfilled.
+        """
+        with self.transaction() as conn:
+            self._record_fetch(conn, item_key, new_cursor, batch, target_names, backfill_batch, backfill_targets)
+
+    def _queue_batch(self, conn, item_key, batch, target_names):
+        """Stores a batch once and queues it for each named target."""
+        if not target_names:
+            return
+        batch_id = conn.execute("INSERT INTO batches (item_key, cursor, payload, created_at) VALUES (?, ?, ?, ?)",
+                                (item_key, batch["cursor"], json.dumps(batch), _now_iso())).lastrowid
+        conn.executemany("INSERT INTO pending_batches (item_key, target_name, batch_id) VALUES (?, ?, ?)",
+                         [(item_key, name, batch_id) for name in target_names])
+
+    def _delete_orphan_batches(self, conn, item_key):
+        conn.execute("DELETE FROM batches WHERE item_key = ? AND NOT EXISTS "
+                     "(SELECT 1 FROM pending_batches p WHERE p.batch_id = batches.batch_id)", (item_key,))
+
+    def _record_fetch(self, conn, item_key, new_cursor, batch, target_names, backfill_batch=None, backfill_targets=()):
+        self._queue_batch(conn, item_key, batch, target_names)
+        if backfill_batch is not None:
+            self._queue_batch(conn, item_key, backfill_batch, backfill_targets)
+        conn.execute("INSERT INTO cursors (item_key, cursor, updated_at) VALUES (?, ?, ?) "
+                     "ON CONFLICT(item_key) DO UPDATE SET cursor=excluded.cursor, updated_at=excluded.updated_at",
+                     (item_key, new_cursor, _now_iso()))
+
+    # --- Actual targets ---
+    def get_target_states(self, item_key):
+        rows = self._connection().execute(
+            f"SELECT target_name, {', '.join(TARGET_STATE_COLUMNS)} FROM targets WHERE item_key = ?", (item_key,))
+        states = {}
+        for row in rows:
+            state = dict(zip(TARGET_STATE_COLUMNS, row[1:]))
+            for column in TARGET_JSON_COLUMNS:
+                state[column] = json.loads(state[column]) if state[column] else None
+            states[row[0]] = state
+        return states
+
+    def get_pending_batches(self, item_key, target_name):
+        rows = self._connection().execute(
+            "SELECT b.payload FROM pending_batches p JOIN batches b ON b.batch_id = p.batch_id "
+            "WHERE p.item_key = ? AND p.target_name = ? ORDER BY p.batch_id", (item_key, target_name))
+        return [json.loads(payload) for (payload,) in rows]
+
+    def save_target_state(self, item_key, target_name, state, clear_pending=False):
+        """Upserts a target's state; clear_pending drops its queued batches (and batches no target still needs)."""
+        with self.transaction() as conn:
+            self._save_target_state(conn, item_key, target_name, state, clear_pending)
+
+    def _save_target_state(self, conn, item_key, target_name, state, clear_pending=False):
+        values = [json.dumps(state.get(c)) if c in TARGET_JSON_COLUMNS and state.get(c) is not None else state.get(c)
+                  for c in TARGET_STATE_COLUMNS]
+        conn.execute(f"INSERT INTO targets (item_key, target_name, {', '.join(TARGET_STATE_COLUMNS)}) "
+                     f"VALUES (?, ?, {', '.join('?' * len(TARGET_STATE_COLUMNS))}) "
+                     f"ON CONFLICT(item_key, target_name) DO UPDATE SET "
+                     f"{', '.join(f'{c}=excluded.{c}' for c in TARGET_STATE_COLUMNS)}",
+                     [item_key, target_name] + values)
+        if clear_pending:
+            conn.execute("DELETE FROM pending_batches WHERE item_key = ? AND target_name = ?", (item_key, target_name))
+            self._delete_orphan_batches(conn, item_key)
+
+    def count_pending_batches(self, item_key):
+        """Returns {target_name: queued batch count} for an item."""
+        rows = self._connection().execute(
+            "SELECT target_name, COUNT(*) FROM pending_batches WHERE item_key = ? GROUP BY target_name", (item_key,))
+        return dict(rows.fetchall())
+
+    def reset_target_queue(self, item_key, target_name):
+        """Drops a target's queue and apply watermark so it is backfilled from full history instead."""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM pending_batches WHERE item_key = ? AND target_name = ?", (item_key, target_name))
+            conn.execute("UPDATE targets SET applied_cursor = NULL WHERE item_key = ? AND target_name = ?", (item_key, target_name))
+            self._delete_orphan_batches(conn, item_key)
+
+    def drop_target(self, item_key, target_name):
+        """Forgets a target that is no longer configured, including its queued batches."""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM pending_batches WHERE item_key = ? AND target_name = ?", (item_key, target_name))
+            conn.execute("DELETE FROM targets WHERE item_key = ? AND target_name = ?", (item_key, target_name))
+            conn.execute("DELETE FROM id_mappings WHERE item_key = ? AND target_name = ?", (item_key, target_name))
+            self._delete_orphan_batches(conn, item_key)
+
+    # --- Plaid-to-Actual id mappings ---
+    def get_id_mappings(self, item_key, target_name, account_id):
+        """Returns {plaid_id: actual_id} for a target's Actual account."""
+        rows = self._connection().execute(
+            "SELECT plaid_id, actual_id FROM id_mappings WHERE item_key = ? AND target_name = ? AND account_id = ?",
+            (item_key, target_name, account_id))
+        return dict(rows.fetchall())
+
+    def save_id_mappings(self, item_key, target_name, account_id, mappings):
+        """Applies {plaid_id: actual_id} changes for a target; an actual_id of None removes the mapping."""
+        if not mappings:
+            return
+        now = _now_iso()
+        with self.transaction() as conn:
+            conn.executemany("INSERT INTO id_mappings (item_key, target_name, plaid_id, account_id, actual_id, updated_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(item_key, target_name, plaid_id) DO UPDATE SET "
+                             "account_id=excluded.account_id, actual_id=excluded.actual_id, updated_at=excluded.updated_at",
+                             [(item_key, target_name, plaid_id, account_id, actual_id, now)
+                              for plaid_id, actual_id in mappings.items() if actual_id])
+            conn.executemany("DELETE FROM id_mappings WHERE item_key = ? AND target_name = ? AND plaid_id = ?",
+                             [(item_key, target_name, plaid_id) for plaid_id, actual_id in mappings.items() if not actual_id])
+
+    # --- Scheduler state ---
+    def get_schedule(self):
+        """Returns (auto_sync, {item_key: schedule entry}); times are Unix timestamps."""
+        conn = self._connection()
+        row = conn.execute("SELECT value FROM settings WHERE key = 'auto_sync'").fetchone()
+        rows = conn.execute(f"SELECT item_key, {', '.join(SCHEDULE_COLUMNS)} FROM schedule").fetchall()
+        return bool(row and row[0] == "1"), {r[0]: dict(zip(SCHEDULE_COLUMNS, r[1:])) for r in rows}
+
+    def save_schedule(self, auto_sync, items):
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('auto_sync', ?)", ("1" if auto_sync else "0",))
+            conn.executemany(f"INSERT OR REPLACE INTO schedule (item_key, {', '.join(SCHEDULE_COLUMNS)}) "
+                             f"VALUES (?, {', '.join('?' * len(SCHEDULE_COLUMNS))})",
+                             [(item_key, *(entry.get(column) for column in SCHEDULE_COLUMNS)) for item_key, entry in items.items()])
+
+    # --- Run history ---
+    def start_run(self, item_key, manual):
+        with self.transaction() as conn:
+            return conn.execute("INSERT INTO runs (item_key, manual, started_at) VALUES (?, ?, ?)",
+                                (item_key, int(manual), _now_iso())).lastrowid
+
+    def finish_run(self, run_id, status, run_stats):
+        with self.transaction() as conn:
+            conn.execute("UPDATE runs SET finished_at = ?, status = ?, added = ?, modified = ?, removed = ? WHERE run_id = ?",
+                         (_now_iso(), status, run_stats.get("added"), run_stats.get("modified"), run_stats.get("removed"), run_id))
+            conn.executemany("INSERT OR REPLACE INTO timings (run_id, section, wall_seconds) VALUES (?, ?, ?)",
+                             [(run_id, section, seconds) for section, seconds in run_stats.get("timings", {}).items()])
+            conn.executemany("INSERT OR REPLACE INTO reconciliations (run_id, target_name, plaid_balance, actual_balance, drift) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             [(run_id, name, r["plaid_balance"], r["actual_balance"], r["drift"])
+                              for name, r in run_stats.get("reconciliations", {}).items()])
+            self._prune_runs(conn, run_id)
+
+    def _prune_runs(self, conn, run_id):
+        """Deletes the run's item's history beyond the newest RUN_HISTORY_KEEP runs."""
+        row = conn.execute("SELECT run_id FROM runs WHERE item_key = (SELECT item_key FROM runs WHERE run_id = ?) "
+                           "ORDER BY run_id DESC LIMIT 1 OFFSET ?", (run_id, RUN_HISTORY_KEEP)).fetchone()
+        if row is None:
+            return
+        old_runs = "SELECT run_id FROM runs WHERE item_key = (SELECT item_key FROM runs WHERE run_id = ?) AND run_id <= ?"
+        for table in ("timings", "reconciliations", "runs"):
+            conn.execute(f"DELETE FROM {table} WHERE run_id IN ({old_runs})", (run_id, row[0]))
+
+    # --- One-time import of the old JSON state file ---
+    def import_legacy_state(self, item_key):
+        """
+        Imports the cursor from sync_state.json ({"last_cursor": ...}) in a single
+        transaction, then renames the file to *.migrated. The GUI target has already
+        applied everything up to that cursor, so it is recorded as its watermark;
+        otherwise the first cycle would backfill it and re-create transactions the
+        user deleted in Actual. A malformed file is left in place and nothing from
+        it is written, so the import is retried next start.
+        """
+        if not os.path.exists(LEGACY_STATE_FILE) or self.get_cursor(item_key) is not None:
+            return
+        try:
+            with open(LEGACY_STATE_FILE, "r") as f:
+                last_cursor = json.load(f).get("last_cursor")
+            with self.transaction() as conn:
+                self._record_fetch(conn, item_key, last_cursor, None, [])
+                if last_cursor:
+                    self._save_target_state(conn, item_key, PRIMARY_TARGET_NAME, {"applied_cursor": last_cursor})
+            os.replace(LEGACY_STATE_FILE, LEGACY_STATE_FILE + ".migrated")
+            logger.info(f"Imported sync state from '{LEGACY_STATE_FILE}' into '{self.path}'.")
+        except (IOError, ValueError, AttributeError, sqlite3.Error) as e:
+            logger.error(f"Could not import legacy state file '{LEGACY_STATE_FILE}': {e!r}. Nothing was imported.")
+
+state_store = StateStore(STATE_FILE)
+state_store.import_legacy_state(PRIMARY_ITEM_KEY)
+
+# ------------------------------------------------------------------------------
+# 6. Set up main Tkinter GUI
 # ------------------------------------------------------------------------------
 root = tk.Tk()
 root.title("Actual Budget – Plaid Sync (actualpy) v2.7") # Version bump
@@ -145,27 +697,57 @@ sync_now_btn = ttk.Button(control_frame, text="Sync Now")
 start_btn = ttk.Button(control_frame, text="Start Auto-Sync")
 stop_btn = ttk.Button(control_frame, text="Stop Auto-Sync", state="disabled")
 launch_link_btn = ttk.Button(link_frame, text="Launch Plaid Link to get/update Access Token")
+profile_var = tk.BooleanVar(value=SYNC_PROFILE)
+profile_check = ttk.Checkbutton(control_frame, text="Profile sync cycles", variable=profile_var)
 
 sync_now_btn.pack(side="left", padx=5, pady=5)
 start_btn.pack(side="left", padx=5, pady=5)
 stop_btn.pack(side="left", padx=5, pady=5)
+profile_check.pack(side="left", padx=5, pady=5)
+balance_status_var = tk.StringVar(value="Balance: not checked")
+ttk.Label(control_frame, textvariable=balance_status_var).pack(side="right", padx=5, pady=5)
 launch_link_btn.pack(side="left", padx=5, pady=5)
 
 # --- Log Area ---
 log_text = ScrolledText(log_frame, height=15, state="disabled", font=("Courier", 9))
 log_text.pack(fill="both", expand=True, padx=5, pady=5)
 
+# Worker threads must not call into Tk while the main thread waits on them,
+# so their log lines and GUI updates (callables, see run_in_gui) are queued
+# and drained from the main loop.
+log_queue = queue.Queue()
+
+def _insert_log_line(message):
+    log_text.config(state="normal")
+    log_text.insert(tk.END, message + "\n")
+    log_text.config(state="disabled")
+    log_text.yview(tk.END)
+
 def append_log(message: str):
     """Append a log message to the ScrolledText widget in a thread-safe way."""
-    def _append():
-        log_text.config(state="normal")
-        log_text.insert(tk.END, message + "\n")
-        log_text.config(state="disabled")
-        log_text.yview(tk.END)
     if threading.current_thread() is threading.main_thread():
-        _append()
+        drain_log_queue(reschedule=False)
+        _insert_log_line(message)
     else:
-        root.after(0, _append)
+        log_queue.put(message)
+
+def run_in_gui(callback):
+    """Queues a callable to run on the Tk main loop; safe to call from any thread."""
+    log_queue.put(callback)
+
+def drain_log_queue(reschedule=True):
+    """Writes queued log lines from worker threads into the log widget and runs queued GUI updates."""
+    while True:
+        try:
+            entry = log_queue.get_nowait()
+        except queue.Empty:
+            break
+        if callable(entry):
+            entry()
+        else:
+            _insert_log_line(entry)
+    if reschedule:
+        root.after(100, drain_log_queue)
 
 class TextHandler(logging.Handler):
     """A logging handler that outputs logs to the Tkinter ScrolledText widget."""
@@ -177,9 +759,10 @@ text_handler = TextHandler()
 text_handler.setLevel(logging.INFO)
 text_handler.setFormatter(formatter)
 logger.addHandler(text_handler)
+root.after(100, drain_log_queue)
 
 # ------------------------------------------------------------------------------
-# 4. Plaid environment configuration and Link workflow
+# 7. Plaid environment configuration and Link workflow
 # ------------------------------------------------------------------------------
 def get_plaid_configuration():
     client_id = client_id_var.get().strip()
@@ -205,12 +788,30 @@ def get_plaid_configuration():
         host=host,
         api_key={"clientId": client_id, "secret": secret}
     )
+    configuration.connection_pool_maxsize = PLAID_POOL_SIZE
     return configuration
 
-def create_link_token(plaid_client):
+_plaid_clients = {}
+_plaid_clients_lock = threading.Lock()
+
+def get_plaid_client():
+    """
+    Returns a shared PlaidApi client for the current credentials. Its ApiClient
+    keeps a pooled HTTP connection manager, so repeated calls reuse connections.
+    """
+    configuration = get_plaid_configuration()
+    key = (configuration.host, configuration.api_key["clientId"], configuration.api_key["secret"])
+    with _plaid_clients_lock:
+        plaid_client = _plaid_clients.get(key)
+        if plaid_client is None:
+            plaid_client = plaid_api.PlaidApi(ApiClient(configuration))
+            _plaid_clients[key] = plaid_client
+    return plaid_client
+
+def create_link_token(plaid_client, client_user_id=None):
     """Create a Plaid link token."""
     try:
-        client_user_id = f"actual_sync_{budget_var.get().strip() or 'default'}"
+        client_user_id = client_user_id or f"actual_sync_{budget_var.get().strip() or 'default'}"
         logger.info(f"Using client_user_id for Plaid Link: {client_user_id}")
 
         request = LinkTokenCreateRequest(
@@ -228,18 +829,41 @@ def create_link_token(plaid_client):
         raise
 
 # ------------------------------------------------------------------------------
-# 5. Flask server for Plaid Link callback
+# 8. Plaid Link service (concurrent sessions on a threaded WSGI server)
 # ------------------------------------------------------------------------------
 flask_app = Flask(__name__)
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.WARNING)
 
+# session_id -> {"link_token", "client_user_id", "created", "status", "item_id", "error", "gui"}
+link_sessions = {}
+link_sessions_lock = threading.Lock()
+link_plaid_client = None # Shared client captured on the GUI thread when the service starts
+exchange_executor = ThreadPoolExecutor(max_workers=LINK_EXCHANGE_WORKERS, thread_name_prefix="plaid-exchange")
+
 PLAID_LINK_HTML = """
 <!DOCTYPE html><html><head><meta charset="utf-8"><title>Plaid Link</title>
 <script src="https://cdn.plaid.com/link/v2/stable/link-initialize.js"></script>
 </head><body><p>Click the button below to link your account via Plaid.</p>
 <button id="link-button">Link Account</button><div id="status"></div>
 <script>
+  var sessionId = "{{ session_id }}";
+  function showResult(data) {
+    if (data.status === 'success') {
+        document.body.innerHTML = "<h1>Success!</h1><p>Access token received. You can close this window and check the application.</p>";
+    } else {
+        document.body.innerHTML = "<h1>Error</h1><p>Failed to exchange public token. Check application logs.</p><p>" + (data.error || '') + "</p>";
+    }
+  }
+  function pollStatus() {
+    fetch('/status/' + sessionId).then(response => response.json())
+    .then(data => {
+      if (data.status === 'exchanging') { setTimeout(pollStatus, 1000); } else { showResult(data); }
+    }).catch(error => {
+       document.body.innerHTML = "<h1>Error</h1><p>Network error while checking status. Check application logs and console.</p>";
+       console.error('Status fetch error:', error);
+    });
+  }
   var handler = Plaid.create({
     token: "{{ link_token }}",
     onSuccess: function(public_token, metadata) {
@@ -247,14 +871,10 @@ PLAID_LINK_HTML = """
       fetch('/callback', {
         method: 'POST',
         headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({public_token: public_token})
+        body: JSON.stringify({public_token: public_token, session_id: sessionId})
       }).then(response => response.json())
       .then(data => {
-        if (data.status === 'success') {
-            document.body.innerHTML = "<h1>Success!</h1><p>Access token received. You can close this window and check the application.</p>";
-        } else {
-            document.body.innerHTML = "<h1>Error</h1><p>Failed to exchange public token. Check application logs.</p><p>" + (data.error || '') + "</p>";
-        }
+        if (data.status === 'exchanging') { pollStatus(); } else { showResult(data); }
       }).catch(error => {
          document.body.innerHTML = "<h1>Error</h1><p>Network error during callback. Check application logs and console.</p>";
          console.error('Callback fetch error:', error);
@@ -275,75 +895,186 @@ PLAID_LINK_HTML = """
 </script></body></html>
 """
 
-@flask_app.route("/link", methods=["GET"])
-def link():
-    global global_link_token
-    if not global_link_token:
-        logger.error("Flask /link endpoint called but global_link_token is not set.")
-        return "Error: Link token not available. Try launching Plaid Link again from the application.", 400
-    return render_template_string(PLAID_LINK_HTML, link_token=global_link_token)
+def create_link_session(plaid_client, client_user_id=None, gui=False, interval_hours=None):
+    """
+    Creates a link token and registers a new Link session for it. Returns the session id.
+    interval_hours, if given, is stored with the linked item as its auto-sync interval.
+    """
+    link_token = create_link_token(plaid_client, client_user_id)
+    session_id = uuid.uuid4().hex
+    now = time.time()
+    with link_sessions_lock:
+        for expired_id in [sid for sid, sess in link_sessions.items() if now - sess["created"] > LINK_SESSION_TTL_SECONDS]:
+            del link_sessions[expired_id]
+        link_sessions[session_id] = {
+            "link_token": link_token, "client_user_id": client_user_id, "created": now,
+            "status": "pending", "item_id": None, "error": None, "gui": gui, "interval_hours": interval_hours,
+        }
+    return session_id
 
-@flask_app.route("/callback", methods=["POST"])
-def callback():
-    from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
+def exchange_public_token(session_id, public_token):
+    """Runs on exchange_executor: swaps the public token and records the result on the session."""
     global global_access_token
-    data = request.get_json()
-    public_token = data.get("public_token")
-
-    if not public_token:
-        logger.error("Plaid callback received without a public token.")
-        return jsonify({"error": "Missing public_token"}), 400
-
+    with link_sessions_lock:
+        link_session = link_sessions.get(session_id)
+    if link_session is None:
+        logger.error(f"Link session {session_id[:8]} expired before its public token could be exchanged.")
+        return
     try:
-        configuration = get_plaid_configuration()
-        api_client = ApiClient(configuration)
-        plaid_client = plaid_api.PlaidApi(api_client)
-
         exchange_req = ItemPublicTokenExchangeRequest(public_token=public_token)
-        exchange_response = plaid_client.item_public_token_exchange(exchange_req)
+        exchange_response = link_plaid_client.item_public_token_exchange(exchange_req)
         ex_data = exchange_response.to_dict()
 
         access_token = ex_data.get("access_token")
         item_id = ex_data.get("item_id")
         if not access_token:
             logger.error(f"Public token exchange response missing access_token. Item ID: {item_id}")
-            return jsonify({"error": "Access token not received from Plaid"}), 500
-
-        logger.info(f"Plaid Link successful. Received new access token for Item ID: {item_id}")
-        global_access_token = access_token
-        root.after(0, lambda: token_var.set(access_token))
-        # root.after(1000, on_sync_now) # Optional: Trigger sync after link
-
-        return jsonify({"status": "success", "item_id": item_id})
+            result = {"status": "error", "error": "Access token not received from Plaid"}
+        else:
+            logger.info(f"Plaid Link successful. Received new access token for Item ID: {item_id} (session {session_id[:8]}).")
+            state_store.save_item(item_id, access_token, link_session["client_user_id"],
+                                  interval_hours=link_session["interval_hours"])
+            if link_session["gui"]:
+                global_access_token = access_token
+                run_in_gui(lambda: token_var.set(access_token))
+                # root.after(1000, on_sync_now) # Optional: Trigger sync after link
+            result = {"status": "success", "item_id": item_id}
 
     except ApiException as e:
         logger.error(f"Plaid API error during public token exchange: {e.body}", exc_info=True)
-        return jsonify({"error": f"Plaid API Error: {e.body}"}), 500
+        result = {"status": "error", "error": f"Plaid API Error: {e.body}"}
     except Exception as e:
         logger.error(f"Unexpected error during public token exchange: {e}", exc_info=True)
-        return jsonify({"error": f"Server Error: {e}"}), 500
+        result = {"status": "error", "error": f"Server Error: {e}"}
+
+    with link_sessions_lock:
+        link_session.update(result)
+
+def log_exchange_failure(future):
+    """Done-callback for exchange futures, so an error escaping exchange_public_token is not lost."""
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Public token exchange task failed: {error}", exc_info=error)
+
+def link_api_authorized():
+    """True if the request carries LINK_API_TOKEN as a Bearer token."""
+    header = request.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    return bool(LINK_API_TOKEN) and scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode(), LINK_API_TOKEN.encode())
+
+@flask_app.route("/link", methods=["GET"])
+def link():
+    session_id = request.args.get("session", "")
+    with link_sessions_lock:
+        link_session = link_sessions.get(session_id)
+    if not link_session:
+        logger.error(f"Flask /link endpoint called with unknown or expired session '{session_id}'.")
+        return "Error: Link session not found or expired. Try launching Plaid Link again from the application.", 400
+    return render_template_string(PLAID_LINK_HTML, link_token=link_session["link_token"], session_id=session_id)
+
+@flask_app.route("/link/session", methods=["POST"])
+def new_link_session():
+    """
+    Creates a Link session for another user; returns its id and the URL to open.
+    Requires "Authorization: Bearer <LINK_API_TOKEN>"; disabled when LINK_API_TOKEN is unset.
+    """
+    if not LINK_API_TOKEN:
+        return jsonify({"error": "Link sessions API is disabled; set LINK_API_TOKEN to enable it"}), 403
+    if not link_api_authorized():
+        logger.warning(f"Rejected unauthorized Link session request from {request.remote_addr}.")
+        return jsonify({"error": "Unauthorized"}), 401
+    if link_plaid_client is None:
+        return jsonify({"error": "Plaid client is not configured yet"}), 503
+    data = request.get_json(silent=True) or {}
+    client_user_id = (data.get("client_user_id") or "").strip()
+    if not client_user_id:
+        return jsonify({"error": "Missing client_user_id"}), 400
+    interval_hours = data.get("interval_hours")
+    if interval_hours is not None and (not isinstance(interval_hours, (int, float)) or isinstance(interval_hours, bool) or interval_hours < 1):
+        return jsonify({"error": "interval_hours must be a number of hours, at least 1"}), 400
+    try:
+        session_id = create_link_session(link_plaid_client, client_user_id, interval_hours=interval_hours)
+    except ApiException as e:
+        logger.error(f"Plaid API error creating Link session for '{client_user_id}': {e.body}")
+        return jsonify({"error": f"Plaid API Error: {e.body}"}), 502
+    except ValueError as e: # Plaid's request models reject invalid fields with ValueError subclasses
+        logger.error(f"Invalid Link session request for '{client_user_id}': {e}")
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    except Exception as e:
+        logger.error(f"Unexpected error creating Link session for '{client_user_id}': {e}", exc_info=True)
+        return jsonify({"error": "Could not reach Plaid to create a Link session"}), 502
+    logger.info(f"Created Plaid Link session {session_id[:8]} for client_user_id '{client_user_id}'.")
+    return jsonify({"session_id": session_id, "link_url": f"{request.host_url}link?session={session_id}"}), 201
+
+@flask_app.route("/callback", methods=["POST"])
+def callback():
+    data = request.get_json(silent=True) or {}
+    public_token = data.get("public_token")
+    session_id = data.get("session_id", "")
+
+    if not public_token:
+        logger.error("Plaid callback received without a public token.")
+        return jsonify({"error": "Missing public_token"}), 400
+
+    with link_sessions_lock:
+        link_session = link_sessions.get(session_id)
+        if not link_session:
+            logger.error(f"Plaid callback received for unknown or expired session '{session_id}'.")
+            return jsonify({"error": "Unknown or expired Link session"}), 404
+        if link_session["status"] != "pending":
+            return jsonify({"status": link_session["status"], "item_id": link_session["item_id"], "error": link_session["error"]})
+        link_session["status"] = "exchanging"
+
+    # The exchange runs off the request thread so bursts of callbacks don't hold WSGI workers
+    exchange_executor.submit(exchange_public_token, session_id, public_token).add_done_callback(log_exchange_failure)
+    return jsonify({"status": "exchanging"}), 202
+
+@flask_app.route("/status/<session_id>", methods=["GET"])
+def link_status(session_id):
+    with link_sessions_lock:
+        link_session = link_sessions.get(session_id)
+        if not link_session:
+            return jsonify({"error": "Unknown or expired Link session"}), 404
+        return jsonify({"status": link_session["status"], "item_id": link_session["item_id"], "error": link_session["error"]})
+
+def run_link_server():
+    try:
+        waitress_serve(flask_app, host=LINK_SERVER_HOST, port=LINK_SERVER_PORT, threads=LINK_SERVER_THREADS)
+    except Exception as e:
+        logger.error(f"Plaid Link service on {LINK_SERVER_HOST}:{LINK_SERVER_PORT} stopped: {e}", exc_info=True)
 
 def start_flask_server():
-    """Runs the Flask server in a daemon thread."""
+    """Runs the Plaid Link service in a daemon thread."""
     global flask_thread
     if not flask_thread or not flask_thread.is_alive():
-        flask_thread = threading.Thread(target=lambda: flask_app.run(port=5001, host='localhost', threaded=True, use_reloader=False), daemon=True)
+        flask_thread = threading.Thread(target=run_link_server, daemon=True)
         flask_thread.start()
-        logger.info("Flask server started on http://localhost:5001 for Plaid Link callback.")
+        logger.info(f"Plaid Link service started on http://{LINK_SERVER_HOST}:{LINK_SERVER_PORT} for Plaid Link callback.")
     else:
-        logger.info("Flask server already running.")
+        logger.info("Plaid Link service already running.")
+
+def start_link_service(when_configured=False):
+    """
+    Captures the pooled Plaid client for the Link service and starts the service,
+    so POST /link/session works without the GUI button. With when_configured=True
+    it quietly waits (returns False) until the Plaid credentials are filled in;
+    otherwise missing credentials raise ValueError.
+    """
+    global link_plaid_client
+    if when_configured and not (client_id_var.get().strip() and secret_var.get().strip()):
+        logger.info("Plaid Link service will start once the Plaid Client ID and Secret are set.")
+        return False
+    link_plaid_client = get_plaid_client()
+    start_flask_server()
+    return True
 
 def launch_plaid_link():
-    """Initiate Plaid Link: create token, start server, open browser."""
-    global global_link_token
+    """Initiate Plaid Link: create a session, start server, open browser."""
     try:
-        configuration = get_plaid_configuration()
-        api_client = ApiClient(configuration)
-        plaid_client = plaid_api.PlaidApi(api_client)
-        global_link_token = create_link_token(plaid_client)
+        start_link_service()
+        session_id = create_link_session(link_plaid_client, gui=True)
         logger.info("Plaid Link token created successfully.")
-        start_flask_server()
-        webbrowser.open("http://localhost:5001/link")
+        webbrowser.open(f"http://{LINK_SERVER_HOST}:{LINK_SERVER_PORT}/link?session={session_id}")
         logger.info("Opened browser to Plaid Link URL.")
     except (ValueError, ApiException) as e:
         logger.error(f"Failed to launch Plaid Link: {e}")
@@ -351,7 +1082,7 @@ def launch_plaid_link():
         logger.error(f"Unexpected error launching Plaid Link: {e}", exc_info=True)
 
 # ------------------------------------------------------------------------------
-# 6. Actual Budget Interaction Logic (Revised for Sync & Workarounds)
+# 9. Actual Budget Interaction Logic (Revised for Sync & Workarounds)
 # ------------------------------------------------------------------------------
 
 def parse_plaid_id_from_note(note):
@@ -417,216 +1148,582 @@ def get_actual_plaid_id_map(session, account):
         logger.error(f"Failed during get_transactions call or processing results: {e}", exc_info=True)
         raise
 
-def process_plaid_updates(session, account, added, modified, removed):
+def actual_txn_amount(txn):
+    """Returns an Actual transaction's amount as a Decimal in currency units (txn.amount is in cents)."""
+    return decimal.Decimal(str(txn.get_amount()))
+
+def batch_for_plaid_account(batch, plaid_account):
+    """Returns the part of a batch that belongs to one Plaid account; a blank account keeps everything."""
+    if not plaid_account:
+        return batch
+    def keep(txns):
+        # Removals queued before account_id was kept have none; they are harmless to pass through
+        return [t for t in txns if t.get("account_id") in (plaid_account, None)]
+    return dict(batch, added=keep(batch["added"]), modified=keep(batch["modified"]), removed=keep(batch["removed"]))
+
+def resolve_mapped_transactions(session, account, batch, known_ids):
+    """
+    Builds the Plaid ID -> Actual transaction map for one batch from the stored
+    id mappings, loading only the transactions the batch touches instead of
+    scanning the whole account. Returns None when an id Plaid reports as
+    modified or removed has no mapping, or a mapping points at a missing,
+    deleted or moved transaction; the caller then falls back to the notes scan.
+    """
+    plaid_id_map = {}
+    required = {t.get("transaction_id") for t in batch["modified"]} | {t.get("transaction_id") for t in batch["removed"]}
+    for plaid_id in required | {t.get("transaction_id") for t in batch["added"]}:
+        if not plaid_id:
+            continue
+        actual_id = known_ids.get(plaid_id)
+        if actual_id is None:
+            if plaid_id in required:
+                return None
+            continue # Not added yet
+        txn = session.get(Transactions, actual_id)
+        if txn is None or txn.tombstone or txn.acct != account.id:
+            return None
+        plaid_id_map[plaid_id] = txn
+    return plaid_id_map
+
+def sum_actual_account_balance(session, account):
+    """Sums every transaction in the account. Only used to seed the running-balance cache."""
+    transactions = get_transactions(session, start_date=date(1970, 1, 1), end_date=date(2099, 12, 31), account=account)
+    return sum((actual_txn_amount(txn) for txn in transactions), decimal.Decimal(0))
+
+def process_plaid_updates(session, account, added, modified, removed, id_mappings=None, plaid_id_map=None):
     """
     Processes transactions fetched from Plaid: deletes removed, updates modified, creates added.
-    Uses Plaid ID stored in Actual notes for matching.
+    Uses Plaid ID stored in Actual notes for matching, unless a prebuilt plaid_id_map
+    is passed. Also returns the net change applied to the account balance, for the
+    running-balance cache. If id_mappings is given, it collects {plaid_id: actual_id}
+    changes (None for deletions).
     """
-    plaid_id_map = get_actual_plaid_id_map(session, account)
+    if id_mappings is None:
+        id_mappings = {}
+    if plaid_id_map is None:
+        with profile_section("map_build"):
+            plaid_id_map = get_actual_plaid_id_map(session, account)
+
+    balance_delta = decimal.Decimal(0)
 
     # --- 1. Process Removed Transactions ---
     deleted_count = 0
-    for removed_item in removed:
-        plaid_id = removed_item.get('transaction_id')
-        if not plaid_id:
-            logger.warning("Found removed transaction item from Plaid with no transaction_id. Skipping.")
-            continue
-        actual_txn = plaid_id_map.pop(plaid_id, None)
-        if actual_txn:
-            try:
-                logger.info(f"Deleting Actual transaction ID {actual_txn.id} (Plaid ID: {plaid_id}).")
-                session.delete(actual_txn) # Assumes session object has a .delete method
-                deleted_count += 1
-            except AttributeError:
-                 logger.error(f"Failed to delete Actual transaction ID {actual_txn.id} (Plaid ID: {plaid_id}): "
-                              f"'session' object likely has no 'delete' method. Check actualpy documentation.", exc_info=True)
-            except Exception as e:
-                logger.error(f"Failed to delete Actual transaction ID {actual_txn.id} (Plaid ID: {plaid_id}): {e}", exc_info=True)
-        else:
-            logger.warning(f"Plaid indicated removal for transaction ID '{plaid_id}', but no matching transaction found in Actual notes.")
+    with profile_section("remove_loop"):
+        for removed_item in removed:
+            plaid_id = removed_item.get('transaction_id')
+            if not plaid_id:
+                logger.warning("Found removed transaction item from Plaid with no transaction_id. Skipping.")
+                continue
+            actual_txn = plaid_id_map.pop(plaid_id, None)
+            if actual_txn:
+                try:
+                    logger.info(f"Deleting Actual transaction ID {actual_txn.id} (Plaid ID: {plaid_id}).")
+                    removed_amount = actual_txn_amount(actual_txn)
+                    session.delete(actual_txn) # Assumes session object has a .delete method
+                    deleted_count += 1
+                    balance_delta -= removed_amount
+                    id_mappings[plaid_id] = None
+                except AttributeError:
+                     logger.error(f"Failed to delete Actual transaction ID {actual_txn.id} (Plaid ID: {plaid_id}): "
+                                  f"'session' object likely has no 'delete' method. Check actualpy documentation.", exc_info=True)
+                except Exception as e:
+                    logger.error(f"Failed to delete Actual transaction ID {actual_txn.id} (Plaid ID: {plaid_id}): {e}", exc_info=True)
+            else:
+                logger.warning(f"Plaid indicated removal for transaction ID '{plaid_id}', but no matching transaction found in Actual notes.")
 
     # --- 2. Process Modified Transactions ---
     updated_count = 0
-    for plaid_txn_dict in modified:
-        plaid_id = plaid_txn_dict.get('transaction_id')
-        if not plaid_id:
-            logger.warning("Found modified transaction item from Plaid with no transaction_id. Skipping.")
-            continue
-        actual_txn = plaid_id_map.pop(plaid_id, None)
-        if actual_txn:
+    with profile_section("modify_loop"):
+        for plaid_txn_dict in modified:
+            plaid_id = plaid_txn_dict.get('transaction_id')
+            if not plaid_id:
+                logger.warning("Found modified transaction item from Plaid with no transaction_id. Skipping.")
+                continue
+            actual_txn = plaid_id_map.pop(plaid_id, None)
+            if actual_txn:
+                try:
+                    needs_update = False
+
+                    # --- Corrected Date Handling (Modified Loop) ---
+                    plaid_date_val = plaid_txn_dict.get("date") # Get the value (might be date obj or str)
+                    plaid_date = None # Initialize to None
+                    if isinstance(plaid_date_val, (dt.date, dt.datetime)):
+                        plaid_date = plaid_date_val.date() if isinstance(plaid_date_val, dt.datetime) else plaid_date_val
+                    elif isinstance(plaid_date_val, str) and plaid_date_val:
+                        try:
+                            plaid_date = dt.datetime.strptime(plaid_date_val, "%Y-%m-%d").date()
+                        except ValueError:
+                            logger.warning(f"Plaid modified txn ID {plaid_id} had invalid date string '{plaid_date_val}'. Skipping date update.")
+                    else:
+                         logger.warning(f"Plaid modified txn ID {plaid_id} had missing or unexpected date type '{type(plaid_date_val)}'. Skipping date update.")
+
+                    # Only proceed with comparison if we got a valid date from Plaid
+                    if plaid_date and actual_txn.date != plaid_date:
+                        logger.info(f"Updating date for Actual Txn ID {actual_txn.id} (Plaid ID: {plaid_id}): {actual_txn.date} -> {plaid_date}")
+                        actual_txn.date = plaid_date
+                        needs_update = True
+                    # --- End Corrected Date Handling ---
+
+                    # Amount
+                    plaid_amt_str = str(plaid_txn_dict.get("amount", 0.0))
+                    if plaid_amt_str: # Check if not empty string after conversion
+                        plaid_amt = decimal.Decimal(plaid_amt_str)
+                        actual_expected_amount = plaid_amt.copy_negate()
+                        # actual_txn.amount is stored in cents; compare and write in currency units
+                        current_amount = actual_txn_amount(actual_txn)
+                        if current_amount != actual_expected_amount:
+                             logger.info(f"Updating amount for Actual Txn ID {actual_txn.id} (Plaid ID: {plaid_id}): {current_amount} -> {actual_expected_amount}")
+                             balance_delta += actual_expected_amount - current_amount
+                             actual_txn.set_amount(actual_expected_amount)
+                             needs_update = True
+                    else:
+                        logger.warning(f"Plaid modified transaction ID '{plaid_id}' has null/empty amount. Skipping amount update.")
+                    # Payee
+                    plaid_payee = plaid_txn_dict.get("merchant_name") or plaid_txn_dict.get("name") or "Unknown Payee"
+                    if actual_txn.payee != plaid_payee:
+                        logger.info(f"Updating payee for Actual Txn ID {actual_txn.id} (Plaid ID: {plaid_id}): '{actual_txn.payee}' -> '{plaid_payee}'")
+                        actual_txn.payee = plaid_payee
+                        needs_update = True
+                    # Notes
+                    new_note = format_note_with_plaid_id(plaid_txn_dict)
+                    if actual_txn.notes != new_note:
+                        logger.info(f"Updating notes for Actual Txn ID {actual_txn.id} (Plaid ID: {plaid_id})")
+                        actual_txn.notes = new_note
+                        needs_update = True
+                    # Cleared status could be added here
+
+                    id_mappings[plaid_id] = str(actual_txn.id)
+                    if needs_update:
+                        logger.info(f"Actual transaction ID {actual_txn.id} marked for update.")
+                        updated_count += 1
+                    else:
+                         logger.debug(f"Actual transaction ID {actual_txn.id} (Plaid ID: {plaid_id}) matches Plaid data. No update needed.")
+                except Exception as e:
+                    logger.error(f"Failed to process update for Actual transaction ID {actual_txn.id} (Plaid ID: {plaid_id}): {e}", exc_info=True)
+            else:
+                logger.warning(f"Plaid modified transaction ID '{plaid_id}', but no matching transaction found in Actual notes. Will attempt to add it.")
+                added.append(plaid_txn_dict)
+
+    # --- 3. Process Added Transactions ---
+    added_count = 0
+    with profile_section("add_loop"):
+        for plaid_txn_dict in added:
+            plaid_id = plaid_txn_dict.get('transaction_id')
+            if not plaid_id:
+                logger.warning("Found added transaction item from Plaid with no transaction_id. Skipping.")
+                continue
+            if plaid_id in plaid_id_map:
+                logger.warning(f"Plaid added transaction ID '{plaid_id}', but it already exists in Actual (Actual ID: {plaid_id_map[plaid_id].id}). Skipping add.")
+                continue
             try:
-                needs_update = False
-
-                # --- Corrected Date Handling (Modified Loop) ---
-                plaid_date_val = plaid_txn_dict.get("date") # Get the value (might be date obj or str)
-                plaid_date = None # Initialize to None
-                if isinstance(plaid_date_val, (dt.date, dt.datetime)):
-                    plaid_date = plaid_date_val.date() if isinstance(plaid_date_val, dt.datetime) else plaid_date_val
-                elif isinstance(plaid_date_val, str) and plaid_date_val:
-                    try:
-                        plaid_date = dt.datetime.strptime(plaid_date_val, "%Y-%m-%d").date()
-                    except ValueError:
-                        logger.warning(f"Plaid modified txn ID {plaid_id} had invalid date string '{plaid_date_val}'. Skipping date update.")
+                # --- Corrected Date Handling (Added Loop) ---
+                date_val = plaid_txn_dict.get("date") # Get the value
+                txn_date = None # Initialize
+                if isinstance(date_val, (dt.date, dt.datetime)):
+                    txn_date = date_val.date() if isinstance(date_val, dt.datetime) else date_val
+                elif isinstance(date_val, str) and date_val: # Check if it's a non-empty string
+                     try:
+                         txn_date = dt.datetime.strptime(date_val, "%Y-%m-%d").date()
+                     except ValueError:
+                          logger.error(f"Plaid added txn ID {plaid_id} had invalid date string '{date_val}'. Using today's date.")
+                          txn_date = date.today() # Fallback
                 else:
-                     logger.warning(f"Plaid modified txn ID {plaid_id} had missing or unexpected date type '{type(plaid_date_val)}'. Skipping date update.")
-
-                # Only proceed with comparison if we got a valid date from Plaid
-                if plaid_date and actual_txn.date != plaid_date:
-                    logger.info(f"Updating date for Actual Txn ID {actual_txn.id} (Plaid ID: {plaid_id}): {actual_txn.date} -> {plaid_date}")
-                    actual_txn.date = plaid_date
-                    needs_update = True
+                     logger.warning(f"Plaid added txn ID {plaid_id} had missing or unexpected date type '{type(date_val)}'. Using today's date.")
+                     txn_date = date.today() # Fallback if missing or wrong type
                 # --- End Corrected Date Handling ---
 
                 # Amount
-                plaid_amt_str = str(plaid_txn_dict.get("amount", 0.0))
-                if plaid_amt_str: # Check if not empty string after conversion
-                    plaid_amt = decimal.Decimal(plaid_amt_str)
-                    actual_expected_amount = plaid_amt.copy_negate()
-                    # Use is_nan() check if necessary, but comparison should work
-                    if actual_txn.amount != actual_expected_amount:
-                         logger.info(f"Updating amount for Actual Txn ID {actual_txn.id} (Plaid ID: {plaid_id}): {actual_txn.amount} -> {actual_expected_amount}")
-                         actual_txn.amount = actual_expected_amount
-                         needs_update = True
-                else:
-                    logger.warning(f"Plaid modified transaction ID '{plaid_id}' has null/empty amount. Skipping amount update.")
+                amount_str = str(plaid_txn_dict.get("amount", "0.0")) # Default to "0.0" string
+                if not amount_str:
+                     logger.warning(f"Plaid added transaction ID '{plaid_id}' has null/empty amount. Skipping add.")
+                     continue
+                amount_decimal = decimal.Decimal(amount_str)
+                actual_amount = amount_decimal.copy_negate()
                 # Payee
-                plaid_payee = plaid_txn_dict.get("merchant_name") or plaid_txn_dict.get("name") or "Unknown Payee"
-                if actual_txn.payee != plaid_payee:
-                    logger.info(f"Updating payee for Actual Txn ID {actual_txn.id} (Plaid ID: {plaid_id}): '{actual_txn.payee}' -> '{plaid_payee}'")
-                    actual_txn.payee = plaid_payee
-                    needs_update = True
+                payee = plaid_txn_dict.get("merchant_name") or plaid_txn_dict.get("name") or "Unknown Payee"
                 # Notes
-                new_note = format_note_with_plaid_id(plaid_txn_dict)
-                if actual_txn.notes != new_note:
-                    logger.info(f"Updating notes for Actual Txn ID {actual_txn.id} (Plaid ID: {plaid_id})")
-                    actual_txn.notes = new_note
-                    needs_update = True
-                # Cleared status could be added here
-
-                if needs_update:
-                    logger.info(f"Actual transaction ID {actual_txn.id} marked for update.")
-                    updated_count += 1
-                else:
-                     logger.debug(f"Actual transaction ID {actual_txn.id} (Plaid ID: {plaid_id}) matches Plaid data. No update needed.")
+                notes = format_note_with_plaid_id(plaid_txn_dict)
+
+                logger.info(f"Creating new Actual transaction for Plaid ID: {plaid_id} (Date: {txn_date}, Payee: '{payee}', Amount: {actual_amount})")
+                # Create
+                created_txn = create_transaction(session, date=txn_date, account=account, payee=payee, notes=notes, amount=actual_amount)
+                added_count += 1
+                balance_delta += actual_amount
+                if created_txn is not None:
+                    id_mappings[plaid_id] = str(created_txn.id)
             except Exception as e:
-                logger.error(f"Failed to process update for Actual transaction ID {actual_txn.id} (Plaid ID: {plaid_id}): {e}", exc_info=True)
-        else:
-            logger.warning(f"Plaid modified transaction ID '{plaid_id}', but no matching transaction found in Actual notes. Will attempt to add it.")
-            added.append(plaid_txn_dict)
+                logger.error(f"Failed to create Actual transaction for Plaid ID {plaid_id}: {e}", exc_info=True)
 
-    # --- 3. Process Added Transactions ---
-    added_count = 0
-    for plaid_txn_dict in added:
-        plaid_id = plaid_txn_dict.get('transaction_id')
-        if not plaid_id:
-            logger.warning("Found added transaction item from Plaid with no transaction_id. Skipping.")
-            continue
-        if plaid_id in plaid_id_map:
-            logger.warning(f"Plaid added transaction ID '{plaid_id}', but it already exists in Actual (Actual ID: {plaid_id_map[plaid_id].id}). Skipping add.")
-            continue
+    logger.info(f"Processing summary: {deleted_count} deleted, {updated_count} updated (marked for update), {added_count} added.")
+    return deleted_count, updated_count, added_count, balance_delta
+
+def load_actual_targets(item_key=PRIMARY_ITEM_KEY):
+    """
+    Returns (targets, complete): the Actual targets to apply an item's Plaid
+    batches to. ACTUAL_TARGETS_FILE is a JSON list of objects with name,
+    server_url, password, budget, account, an optional item (a linked Plaid
+    item_id; defaults to the primary item) and an optional plaid_account (the
+    one Plaid account_id the target mirrors; blank = every account on the
+    item, PLAID_ACCOUNT_ID for the GUI target). The file holds Actual passwords,
+    so it is restricted to the owner (0600). The primary item also gets the
+    target configured in the GUI, if any field is filled. Targets with missing
+    settings are left out. complete is False when ACTUAL_TARGETS_FILE could not
+    be read, so callers don't mistake its targets for removed ones.
+    """
+    complete = True
+    targets = []
+    primary = {
+        "name": PRIMARY_TARGET_NAME,
+        "server_url": actual_url_var.get().strip(),
+        "password": actual_pass_var.get().strip(),
+        "budget": budget_var.get().strip(),
+        "account": account_var.get().strip(),
+        "plaid_account": PLAID_ACCOUNT_ID,
+    }
+    if any(primary[key] for key in ("password", "budget", "account")):
+        targets.append(primary)
+
+    if os.path.exists(ACTUAL_TARGETS_FILE):
+        restrict_to_owner(ACTUAL_TARGETS_FILE) # Holds Actual passwords in plaintext
         try:
-            # --- Corrected Date Handling (Added Loop) ---
-            date_val = plaid_txn_dict.get("date") # Get the value
-            txn_date = None # Initialize
-            if isinstance(date_val, (dt.date, dt.datetime)):
-                txn_date = date_val.date() if isinstance(date_val, dt.datetime) else date_val
-            elif isinstance(date_val, str) and date_val: # Check if it's a non-empty string
-                 try:
-                     txn_date = dt.datetime.strptime(date_val, "%Y-%m-%d").date()
-                 except ValueError:
-                      logger.error(f"Plaid added txn ID {plaid_id} had invalid date string '{date_val}'. Using today's date.")
-                      txn_date = date.today() # Fallback
+            with open(ACTUAL_TARGETS_FILE, "r") as f:
+                extra_targets = json.load(f)
+            if not isinstance(extra_targets, list):
+                raise ValueError("expected a JSON list of target objects")
+        except (IOError, ValueError) as e:
+            logger.error(f"Could not load Actual targets from '{ACTUAL_TARGETS_FILE}': {e}. Using GUI target only.")
+            extra_targets = []
+            complete = False
+        seen_names = {target["name"] for target in targets}
+        for entry in extra_targets:
+            target = {key: str(entry.get(key) or "").strip() for key in ACTUAL_TARGET_KEYS} if isinstance(entry, dict) else {}
+            if not target or not target["name"]:
+                logger.warning(f"Skipping Actual target without a name in '{ACTUAL_TARGETS_FILE}'.")
+            elif target["name"] in seen_names:
+                logger.warning(f"Skipping duplicate Actual target name '{target['name']}' in '{ACTUAL_TARGETS_FILE}'.")
             else:
-                 logger.warning(f"Plaid added txn ID {plaid_id} had missing or unexpected date type '{type(date_val)}'. Using today's date.")
-                 txn_date = date.today() # Fallback if missing or wrong type
-            # --- End Corrected Date Handling ---
-
-            # Amount
-            amount_str = str(plaid_txn_dict.get("amount", "0.0")) # Default to "0.0" string
-            if not amount_str:
-                 logger.warning(f"Plaid added transaction ID '{plaid_id}' has null/empty amount. Skipping add.")
-                 continue
-            amount_decimal = decimal.Decimal(amount_str)
-            actual_amount = amount_decimal.copy_negate()
-            # Payee
-            payee = plaid_txn_dict.get("merchant_name") or plaid_txn_dict.get("name") or "Unknown Payee"
-            # Notes
-            notes = format_note_with_plaid_id(plaid_txn_dict)
-
-            logger.info(f"Creating new Actual transaction for Plaid ID: {plaid_id} (Date: {txn_date}, Payee: '{payee}', Amount: {actual_amount})")
-            # Create
-            create_transaction(session, date=txn_date, account=account, payee=payee, notes=notes, amount=actual_amount)
-            added_count += 1
-        except Exception as e:
-            logger.error(f"Failed to create Actual transaction for Plaid ID {plaid_id}: {e}", exc_info=True)
+                seen_names.add(target["name"])
+                target["item"] = str(entry.get("item") or PRIMARY_ITEM_KEY)
+                target["plaid_account"] = str(entry.get("plaid_account") or "").strip()
+                targets.append(target)
+
+    usable = []
+    for target in targets:
+        if target.get("item", PRIMARY_ITEM_KEY) != item_key:
+            continue
+        missing = [key for key in ACTUAL_TARGET_KEYS if not target[key]]
+        if missing:
+            logger.error(f"Actual Budget settings for target '{target['name']}' are incomplete (missing {', '.join(missing)}). Skipping it.")
+        else:
+            usable.append(target)
+    return usable, complete
 
-    logger.info(f"Processing summary: {deleted_count} deleted, {updated_count} updated (marked for update), {added_count} added.")
-    return deleted_count, updated_count, added_count
+def apply_batches_to_target(item_key, target, batches, balance_cache=None):
+    """
+    Applies queued Plaid batches, oldest first, to one Actual target in a single
+    session and commits once. Raises on failure so the caller can keep the
+    batches queued for the next cycle.
+
+    Only transactions of the target's plaid_account (if set) are applied.
+
+    Returns the updated running-balance cache ({"account_id", "balance",
+    "resummed"}). The cache is adjusted by the applied deltas; the account is
+    only summed in full (resummed=True) when there is no cache, e.g. after
+    reconcile_balances dropped it, or it belongs to a different account.
+
+    Matching uses the stored Plaid-to-Actual id mappings, seeded from a full
+    notes scan the first time an account has none. Mapping changes are saved
+    before the commit: if the commit then fails, the stale mappings fail
+    resolve_mapped_transactions and that batch falls back to the notes scan.
+    """
+    name = target["name"]
+    if not all(target[key] for key in ACTUAL_TARGET_KEYS):
+        raise ValueError(f"Actual Budget settings for target '{name}' are incomplete.")
+
+    with profile_section(f"target:{name}"):
+        with Actual(base_url=target["server_url"], password=target["password"], file=target["budget"]) as act:
+            session = act.session
+            logger.info(f"[{name}] Connected to Actual Budget file '{target['budget']}'.")
+            acct = get_account(session, target["account"])
+            if acct is None:
+                logger.info(f"[{name}] Account '{target['account']}' not found; creating it now.")
+                acct = create_account(session, name=target["account"])
+                if acct is None:
+                     raise Exception(f"Failed to create Actual account '{target['account']}'. Check actualpy documentation.")
+                logger.info(f"[{name}] Created Actual account '{target['account']}' with ID {acct.id}. You may need to set the account type manually in Actual Budget.")
+
+            resummed = not (balance_cache and balance_cache.get("account_id") == str(acct.id))
+            if resummed:
+                logger.info(f"[{name}] Summing account '{target['account']}' to seed the running-balance cache.")
+                with profile_section("balance_seed"):
+                    running_balance = sum_actual_account_balance(session, acct)
+            else:
+                running_balance = decimal.Decimal(balance_cache["balance"])
+
+            account_id = str(acct.id)
+            known_ids = state_store.get_id_mappings(item_key, name, account_id)
+            id_mappings = {}
+            if not known_ids:
+                logger.info(f"[{name}] Seeding Plaid-to-Actual id mappings from Actual notes.")
+                with profile_section("map_build"):
+                    id_mappings = {plaid_id: str(txn.id) for plaid_id, txn in get_actual_plaid_id_map(session, acct).items()}
+                known_ids.update(id_mappings)
+
+            total_changes = 0
+            for batch in batches:
+                batch = batch_for_plaid_account(batch, target["plaid_account"])
+                with profile_section("map_lookup"):
+                    plaid_id_map = resolve_mapped_transactions(session, acct, batch, known_ids)
+                if plaid_id_map is None:
+                    logger.info(f"[{name}] Stored id mappings don't cover this batch; scanning Actual notes instead.")
+                # process_plaid_updates appends to the added list, so each target gets its own copy
+                batch_mappings = {}
+                d_count, u_count, a_count, delta = process_plaid_updates(session, acct, list(batch["added"]), batch["modified"],
+                                                                         batch["removed"], batch_mappings, plaid_id_map)
+                id_mappings.update(batch_mappings)
+                for plaid_id, actual_id in batch_mappings.items():
+                    if actual_id:
+                        known_ids[plaid_id] = actual_id
+                    else:
+                        known_ids.pop(plaid_id, None)
+                total_changes += d_count + u_count + a_count
+                running_balance += delta
+            # A failure here raises before the commit, so the batches stay queued
+            state_store.save_id_mappings(item_key, name, account_id, id_mappings)
+            if total_changes > 0:
+                 logger.info(f"[{name}] Committing changes to Actual Budget...")
+                 with profile_section("actual_commit"):
+                     act.commit()
+                 logger.info(f"[{name}] Actual Budget changes committed successfully.")
+            else:
+                 logger.info(f"[{name}] No changes needed to be committed to Actual Budget.")
+            return {"account_id": str(acct.id), "balance": str(running_balance), "resummed": resummed}
 
 # ------------------------------------------------------------------------------
-# 7. Sync process using Plaid transactions_sync
+# 10. Sync process using Plaid transactions_sync
 # ------------------------------------------------------------------------------
-def sync_transactions(is_manual_run=False, retry_count=0): # Add retry_count
+
+def fetch_transactions_sync_page(plaid_client, request_obj):
+    """Calls transactions_sync without model deserialization and decodes the raw body."""
+    raw_response = plaid_client.transactions_sync(request_obj, _preload_content=False)
+    return decode_transactions_sync_page(raw_response.data)
+
+def fetch_plaid_changes(plaid_client, access_token, cursor):
+    """
+    Pages through transactions_sync from cursor (None = full history) and returns
+    the combined batch plus the latest account balances. Plaid errors propagate.
+    """
+    batch = {"cursor": cursor, "added": [], "modified": [], "removed": []}
+    plaid_accounts = []
+    has_more = True
+    while has_more:
+        request_obj = TransactionsSyncRequest(access_token=access_token)
+        if batch["cursor"]: request_obj.cursor = batch["cursor"]
+        logger.debug(f"Fetching Plaid transactions with cursor: {batch['cursor']}")
+        res = fetch_transactions_sync_page(plaid_client, request_obj)
+        added = res.get("added", [])
+        modified = res.get("modified", [])
+        removed = res.get("removed", [])
+        plaid_accounts = res.get("accounts") or plaid_accounts
+        has_more = res.get("has_more", False)
+        batch["added"].extend(added)
+        batch["modified"].extend(modified)
+        batch["removed"].extend(removed)
+        batch["cursor"] = res.get("next_cursor")
+        logger.info(f"Fetched page: {len(added)} new, {len(modified)} modified, {len(removed)} removed. Has More: {has_more}")
+    return batch, plaid_accounts
+
+def plaid_balance_for_actual(plaid_accounts, account_id=""):
+    """
+    Converts Plaid 'current' balances into the balance Actual should show for a
+    target: liabilities are negated, and all accounts are summed unless account_id
+    (the target's plaid_account) selects one. Returns None if no balance is available.
+    """
+    balance = None
+    for plaid_account in plaid_accounts:
+        if account_id and plaid_account.get("account_id") != account_id:
+            continue
+        current = plaid_account.get("current")
+        if current is None:
+            continue
+        amount = decimal.Decimal(str(current))
+        if plaid_account.get("type") in PLAID_LIABILITY_TYPES:
+            amount = amount.copy_negate()
+        balance = amount if balance is None else balance + amount
+    return balance
+
+# Latest balance status per item; the GUI label shows them all
+balance_statuses = {}
+
+def show_balance_status(item_key, status):
+    balance_statuses[item_key] = status
+    balance_status_var.set(" | ".join(f"{key}: {text}" for key, text in sorted(balance_statuses.items())))
+
+def reconcile_balances(item_key, targets, target_states, plaid_accounts, applied):
+    """
+    Compares the cached running balance of each target in applied with Plaid's
+    balance for the target's plaid_account, records the result in the target's
+    state and returns {target_name: result} for the run history. Targets whose
+    batches did not apply this cycle are shown as pending, since their cache
+    lags Plaid. Drift above BALANCE_DRIFT_THRESHOLD is logged and shown in the
+    GUI, and unless the cache was just summed from Actual it is dropped, so the
+    next cycle re-sums the account to tell cache error from real drift. Never
+    touches Actual itself, so it is cheap every cycle.
+    """
+    results = {}
+    drifted = []
+    checked = []
+    pending = []
+    unavailable = []
+    for target in targets:
+        if target["name"] not in applied:
+            pending.append(target["name"])
+            continue
+        target_state = target_states.get(target["name"], {})
+        balance_cache = target_state.get("balance_cache")
+        if not balance_cache:
+            continue
+        plaid_balance = plaid_balance_for_actual(plaid_accounts, target["plaid_account"])
+        if plaid_balance is None:
+            unavailable.append(target["name"])
+            continue
+        checked.append(target["name"])
+        actual_balance = decimal.Decimal(balance_cache["balance"])
+        drift = actual_balance - plaid_balance
+        target_state["reconciliation"] = results[target["name"]] = {
+            "checked_at": _now_iso(),
+            "plaid_balance": str(plaid_balance),
+            "actual_balance": str(actual_balance),
+            "drift": str(drift),
+        }
+        if abs(drift) > BALANCE_DRIFT_THRESHOLD:
+            drifted.append(f"{target['name']} {drift:+.2f}")
+            logger.warning(f"[{target['name']}] Balance drift: Actual {actual_balance:.2f} vs Plaid {plaid_balance:.2f} "
+                           f"(drift {drift:+.2f}, threshold {BALANCE_DRIFT_THRESHOLD}).")
+            if not balance_cache.get("resummed"):
+                logger.info(f"[{target['name']}] Re-summing the Actual account next cycle to verify the drift.")
+                target_state["balance_cache"] = None
+        else:
+            logger.info(f"[{target['name']}] Balance reconciled: Actual {actual_balance:.2f} matches Plaid {plaid_balance:.2f}.")
+    if drifted:
+        status = f"Balance drift: {', '.join(drifted)}"
+    elif checked:
+        status = f"Balance OK ({', '.join(checked)})"
+    else:
+        status = "Balance: not checked"
+    if unavailable:
+        logger.info(f"Plaid returned no balance for target(s) {', '.join(unavailable)}; skipped their reconciliation.")
+        status += f"; not available from Plaid: {', '.join(unavailable)}"
+    if pending:
+        status += f"; pending: {', '.join(pending)}"
+    show_balance_status(item_key, status)
+    return results
+
+def sync_transactions(item_key=PRIMARY_ITEM_KEY, is_manual_run=False, retry_count=0):
     """
-    Fetch transactions from Plaid via transactions_sync, process updates in Actual,
-    and schedule the next run if auto-sync is enabled. Handles Plaid pagination errors.
+    Runs one sync cycle for a Plaid item and records it in the run history, wrapped in a
+    CycleProfiler when profiling is enabled. Each profiled cycle writes a report
+    next to the log file; only the newest SYNC_PROFILE_KEEP reports are kept.
+    Returns the cycle's outcome.
     """
-    global global_access_token, sync_after_id
+    global active_profiler
+    run_stats = {"timings": {}}
+    status = "failed"
+    try:
+        run_id = state_store.start_run(item_key, is_manual_run)
+    except sqlite3.Error as e:
+        logger.error(f"Failed to record sync run in '{STATE_FILE}': {e}")
+        run_id = None
+
+    if profile_var.get():
+        active_profiler = CycleProfiler()
+        active_profiler.start()
+    try:
+        status = run_sync_cycle(item_key, is_manual_run=is_manual_run, retry_count=retry_count, run_stats=run_stats)
+        return status
+    finally:
+        if run_id is not None:
+            try:
+                state_store.finish_run(run_id, status, run_stats)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to record sync run in '{STATE_FILE}': {e}")
+        if active_profiler is not None:
+            write_profile_report()
+
+def write_profile_report():
+    """Stops the active profiler and saves its report next to the log file."""
+    global active_profiler
+    profiler, active_profiler = active_profiler, None
+    profiler.stop()
+    report_dir = os.path.dirname(os.path.abspath(log_filename))
+    base_path = os.path.join(report_dir, f"{PROFILE_REPORT_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+    try:
+        profiler.write_reports(base_path)
+        prune_profile_reports(report_dir, SYNC_PROFILE_KEEP)
+        logger.info(f"Saved sync profile report to {base_path}.txt ({profiler.samples} samples).")
+    except IOError as e:
+        logger.error(f"Failed to write sync profile report '{base_path}': {e}")
+
+def run_sync_cycle(item_key=PRIMARY_ITEM_KEY, is_manual_run=False, retry_count=0, run_stats=None): # Add retry_count
+    """
+    Fetch an item's transactions from Plaid via transactions_sync and apply them to its Actual targets.
+    The primary item uses the access token from the GUI; linked items use the token in the items table.
+    Returns "success", "failed", or "retry" when a Plaid pagination error should be retried
+    after RETRY_DELAY_SECONDS; the caller (scheduler or manual sync) decides when to run next.
+    Fetch counts and section timings are written into run_stats for the run history.
+    """
+    global global_access_token
     MAX_RETRIES = 1
 
     if retry_count == 0:
-        logger.info("Starting sync cycle...")
+        logger.info(f"Starting sync cycle for item '{item_key}'...")
 
-    current_access_token = token_var.get().strip()
-    if not current_access_token:
-        logger.error("Plaid Access Token is missing. Cannot sync.")
-        if sync_after_id: on_stop()
-        if is_manual_run: sync_now_btn.config(state="normal")
-        return
-    global_access_token = current_access_token
+    if item_key == PRIMARY_ITEM_KEY:
+        access_token = token_var.get().strip()
+        global_access_token = access_token
+    else:
+        try:
+            access_token = state_store.get_item_token(item_key)
+        except sqlite3.Error as e:
+            logger.error(f"Could not load access token for item '{item_key}' from '{STATE_FILE}': {e}")
+            return "failed"
+    if not access_token:
+        logger.error(f"Plaid Access Token for item '{item_key}' is missing. Cannot sync.")
+        return "failed"
+
+    if run_stats is None:
+        run_stats = {"timings": {}}
+    timings = run_stats.setdefault("timings", {})
 
     # --- Load Cursor ---
     cursor = None
+    target_states = {}
     try:
-        if os.path.exists(STATE_FILE):
-            with open(STATE_FILE, "r") as f:
-                state_data = json.load(f)
-                cursor = state_data.get("last_cursor")
-                if retry_count == 0:
-                     logger.info(f"Loaded previous cursor: {cursor}")
-    except (IOError, json.JSONDecodeError) as e:
-        logger.warning(f"Could not load cursor from state file '{STATE_FILE}': {e}. Starting sync from beginning (if no cursor).")
+        cursor = state_store.get_cursor(item_key)
+        target_states = state_store.get_target_states(item_key)
+        if retry_count == 0 and cursor:
+             logger.info(f"Loaded previous cursor: {cursor}")
+    except sqlite3.Error as e:
+        logger.warning(f"Could not load cursor from state store '{STATE_FILE}': {e}. Starting sync from beginning (if no cursor).")
 
     # --- Fetch from Plaid ---
     all_added, all_modified, all_removed = [], [], []
+    plaid_accounts = []
+    plaid_client = None
     new_cursor = cursor
-    has_more = True
     plaid_fetch_success = False
-    plaid_pagination_error = False
 
+    fetch_started = time.perf_counter()
     try:
-        configuration = get_plaid_configuration()
-        api_client = ApiClient(configuration)
-        plaid_client = plaid_api.PlaidApi(api_client)
-        while has_more:
-            request_obj = TransactionsSyncRequest(access_token=global_access_token)
-            if new_cursor: request_obj.cursor = new_cursor
-            logger.debug(f"Fetching Plaid transactions with cursor: {new_cursor}")
-            response = plaid_client.transactions_sync(request_obj)
-            res = response.to_dict()
-            added = res.get("added", [])
-            modified = res.get("modified", [])
-            removed = res.get("removed", [])
-            has_more = res.get("has_more", False)
-            next_cursor_from_plaid = res.get("next_cursor")
-            all_added.extend(added)
-            all_modified.extend(modified)
-            all_removed.extend(removed)
-            new_cursor = next_cursor_from_plaid
-            logger.info(f"Fetched page: {len(added)} new, {len(modified)} modified, {len(removed)} removed. Has More: {has_more}")
+        plaid_client = get_plaid_client()
+        with profile_section("plaid_fetch"):
+            batch, plaid_accounts = fetch_plaid_changes(plaid_client, access_token, cursor)
+        all_added, all_modified, all_removed = batch["added"], batch["modified"], batch["removed"]
+        new_cursor = batch["cursor"]
 
         logger.info(f"Plaid fetch complete. Total: {len(all_added)} added, {len(all_modified)} modified, {len(all_removed)} removed.")
         plaid_fetch_success = True
+        run_stats.update(added=len(all_added), modified=len(all_modified), removed=len(all_removed))
 
     except ApiException as e:
         error_body_dict = {}
@@ -642,100 +1739,273 @@ def sync_transactions(is_manual_run=False, retry_count=0): # Add retry_count
         logger.error(f"Plaid API error during transaction sync: {error_body_str}", exc_info=False) # exc_info=False for Plaid API errors unless debugging
 
         if error_code == "TRANSACTIONS_SYNC_MUTATION_DURING_PAGINATION":
-            plaid_pagination_error = True
             if retry_count < MAX_RETRIES:
                 logger.warning(f"Plaid pagination error detected. Retrying sync after {RETRY_DELAY_SECONDS} seconds (Attempt {retry_count + 1}/{MAX_RETRIES})...")
-                root.after(RETRY_DELAY_SECONDS * 1000, lambda: sync_transactions(is_manual_run=is_manual_run, retry_count=retry_count + 1))
-                return
+                return "retry"
             else:
                 logger.error(f"Plaid pagination error persisted after {MAX_RETRIES} retries. Aborting sync cycle.")
         elif "ITEM_LOGIN_REQUIRED" in error_body_str:
              logger.error("Plaid item requires login. Please re-link the account using Plaid Link.")
-             if sync_after_id: on_stop()
 
     except ValueError as e:
          logger.error(f"Configuration error: {e}")
     except Exception as e:
         logger.error(f"Unexpected error during Plaid transaction sync: {e}", exc_info=True)
 
-    # --- Save Cursor ---
+    timings["plaid_fetch"] = time.perf_counter() - fetch_started
+
+    # --- Queue Batch for Each Actual Target ---
+    # Each target keeps its own queue of unapplied batches and an apply watermark
+    # (the Plaid cursor it has caught up to), so one Plaid fetch serves all targets.
+    targets, targets_complete = load_actual_targets(item_key)
     if plaid_fetch_success:
+        if not targets:
+            logger.error("No Actual Budget targets are configured. Cannot process updates.")
+        target_names = {t["name"] for t in targets}
         try:
-            with open(STATE_FILE, "w") as f:
-                json.dump({"last_cursor": new_cursor}, f)
-                logger.info(f"Successfully saved new cursor to {STATE_FILE}: {new_cursor}")
-        except IOError as e:
-            logger.error(f"CRITICAL: Failed to save cursor to state file '{STATE_FILE}': {e}. Risk of duplicates!")
+            if targets_complete:
+                for stale_name in set(target_states) - target_names:
+                    logger.warning(f"[{stale_name}] Actual target is no longer configured; dropping its state and queued batches.")
+                    state_store.drop_target(item_key, stale_name)
+                    del target_states[stale_name]
+            pending_counts = state_store.count_pending_batches(item_key)
+            for name in target_names:
+                queued = pending_counts.get(name, 0)
+                if queued >= PENDING_BATCH_LIMIT:
+                    logger.warning(f"[{name}] {queued} Plaid batches queued; replacing them with a full-history backfill.")
+                    state_store.reset_target_queue(item_key, name)
+                    pending_counts[name] = 0
+                    target_states.get(name, {})["applied_cursor"] = None
+                elif queued >= PENDING_BATCH_WARN:
+                    logger.warning(f"[{name}] {queued} Plaid batches are queued and not yet applied. Check this target's errors.")
+        except sqlite3.Error as e:
+            logger.error(f"Failed to tidy Actual target queues in '{STATE_FILE}': {e}")
+            pending_counts = {}
+
+        # A target with no apply watermark joined after this item's first sync (or had its
+        # queue reset): it needs the full history, not just the changes since the item's cursor.
+        backfill_targets = [name for name in target_names if cursor is not None
+                            and not target_states.get(name, {}).get("applied_cursor") and not pending_counts.get(name)]
+        backfill_batch = None
+        awaiting_backfill = set()
+        if backfill_targets:
+            logger.info(f"Backfilling full Plaid history for new Actual target(s): {', '.join(sorted(backfill_targets))}")
+            try:
+                with profile_section("plaid_backfill"):
+                    backfill_batch, _ = fetch_plaid_changes(plaid_client, access_token, None)
+            except Exception as e:
+                logger.error(f"Plaid backfill fetch failed; will retry next cycle: {e}")
+                awaiting_backfill.update(backfill_targets)
+                backfill_targets = []
+
+        has_changes = bool(all_added or all_modified or all_removed)
+        # On an item's first sync every target gets the batch, even if empty, so its account is created
+        queue_for = [name for name in target_names if name not in backfill_targets and (has_changes or cursor is None)]
+        try:
+            state_store.record_fetch(item_key, new_cursor, batch, queue_for, backfill_batch, backfill_targets)
+            logger.info(f"Successfully saved new cursor to {STATE_FILE}: {new_cursor}")
+        except sqlite3.Error as e:
+            logger.error(f"CRITICAL: Failed to save cursor to state store '{STATE_FILE}': {e}. Risk of duplicates!")
             plaid_fetch_success = False
 
-    # --- Process Updates in Actual Budget ---
+    # --- Process Updates in Actual Budget Targets ---
     actual_update_success = False
-    needs_actual_update = plaid_fetch_success and (all_added or all_modified or all_removed or cursor is None)
-
-    if needs_actual_update:
-        logger.info("Connecting to Actual Budget to process updates...")
-        actual_url = actual_url_var.get().strip()
-        actual_pass = actual_pass_var.get().strip()
-        budget_name = budget_var.get().strip()
-        account_name = account_var.get().strip()
-        if not all([actual_url, actual_pass, budget_name, account_name]):
-            logger.error("Actual Budget settings are incomplete. Cannot process updates.")
+    if plaid_fetch_success:
+        # Targets whose backfill could not be fetched keep no watermark, so they are retried
+        targets = [t for t in targets if t["name"] not in awaiting_backfill]
+    if plaid_fetch_success and targets:
+        apply_started = time.perf_counter()
+        try:
+            pending = {t["name"]: state_store.get_pending_batches(item_key, t["name"]) for t in targets}
+        except sqlite3.Error as e:
+            logger.error(f"Could not load queued Plaid batches from '{STATE_FILE}': {e}. They stay queued for the next cycle.")
+            logger.info("Sync cycle failed.")
+            return "failed"
+        # A target without a balance cache (new, or dropped after drift) is applied even with
+        # nothing queued, so its Actual account is summed and the cache reseeded
+        pending_targets = [t for t in targets if pending[t["name"]] or not target_states.get(t["name"], {}).get("balance_cache")]
+        if pending_targets:
+            logger.info(f"Applying updates to {len(pending_targets)} Actual target(s): {', '.join(t['name'] for t in pending_targets)}")
+            with ThreadPoolExecutor(max_workers=len(pending_targets), thread_name_prefix="actual-target") as executor:
+                futures = {t["name"]: executor.submit(apply_batches_to_target, item_key, t, pending[t["name"]],
+                                                      target_states.get(t["name"], {}).get("balance_cache"))
+                           for t in pending_targets}
         else:
+            logger.info("No new, modified, or removed transactions fetched from Plaid.")
+            futures = {}
+        timings["actual_apply"] = time.perf_counter() - apply_started
+
+        now_str = _now_iso()
+        applied = set()
+        for target in targets:
+            target_state = target_states.setdefault(target["name"], {})
+            future = futures.get(target["name"])
+            error = future.exception() if future else None
+            if error is None:
+                target_state.update(applied_cursor=new_cursor, last_success=now_str, last_error=None)
+                if future:
+                    target_state["balance_cache"] = future.result()
+                applied.add(target["name"])
+                actual_update_success = True
+            else:
+                target_state["last_error"] = f"{now_str}: {error}"
+                logger.error(f"[{target['name']}] Error during Actual Budget update: {error}", exc_info=error)
+                logger.warning(f"[{target['name']}] {len(pending[target['name']])} Plaid batch(es) kept queued for the next cycle.")
+
+        check_started = time.perf_counter()
+        with profile_section("balance_check"):
+            run_stats["reconciliations"] = reconcile_balances(item_key, targets, target_states, plaid_accounts, applied)
+        timings["balance_check"] = time.perf_counter() - check_started
+        for target in targets:
             try:
-                with Actual(base_url=actual_url, password=actual_pass, file=budget_name) as act:
-                    session = act.session
-                    logger.info(f"Connected to Actual Budget file '{budget_name}'.")
-                    acct = get_account(session, account_name)
-                    if acct is None:
-                        logger.info(f"Account '{account_name}' not found; creating it now.")
-                        acct = create_account(session, name=account_name)
-                        if acct is None:
-                             raise Exception(f"Failed to create Actual account '{account_name}'. Check actualpy documentation.")
-                        logger.info(f"Created Actual account '{account_name}' with ID {acct.id}. You may need to set the account type manually in Actual Budget.")
-
-                    d_count, u_count, a_count = process_plaid_updates(session, acct, all_added, all_modified, all_removed)
-                    if d_count > 0 or u_count > 0 or a_count > 0:
-                         logger.info("Committing changes to Actual Budget...")
-                         act.commit()
-                         logger.info("Actual Budget changes committed successfully.")
-                    else:
-                         logger.info("No changes needed to be committed to Actual Budget.")
-                    actual_update_success = True
+                state_store.save_target_state(item_key, target["name"], target_states[target["name"]],
+                                              clear_pending=target["name"] in applied)
+            except sqlite3.Error as e:
+                logger.error(f"[{target['name']}] Failed to save Actual target state to '{STATE_FILE}': {e}. Applied batches may be re-applied next cycle.")
 
-            except ImportError:
-                 logger.error("Failed to import 'actualpy'. Is it installed correctly?")
-            except Exception as e:
-                logger.error(f"Error during Actual Budget update: {e}", exc_info=True)
+    # --- Report Outcome ---
+    overall_success = plaid_fetch_success and actual_update_success
+    logger.info("Sync cycle finished." if overall_success else "Sync cycle failed.")
+    return "success" if overall_success else "failed"
 
-    elif plaid_fetch_success:
-        logger.info("No new, modified, or removed transactions fetched from Plaid.")
-        actual_update_success = True
 
-    # --- Reschedule ---
-    overall_success = plaid_fetch_success and actual_update_success
+# ------------------------------------------------------------------------------
+# 11. Persistent scheduler (per-item cadence, jitter, catch-up and backoff)
+# ------------------------------------------------------------------------------
+# In-memory copy of the schedule and settings tables: {"auto_sync": bool, "items": {item_key:
+#   {"interval_hours", "next_run", "last_run", "last_status", "failures", "retry_count"}}}.
+schedule_state = {"auto_sync": False, "items": {}}
 
-    if not plaid_pagination_error or retry_count >= MAX_RETRIES:
-        if sync_after_id: # Auto-sync mode
-            if overall_success:
-                interval_hours = max(1, interval_var.get())
-                interval_ms = interval_hours * 3600 * 1000
-                logger.info(f"Scheduling next sync in {interval_hours} hours.")
-                sync_after_id = root.after(interval_ms, lambda: sync_transactions(is_manual_run=False, retry_count=0))
-            else:
-                logger.error("Sync cycle failed. Stopping auto-sync.")
-                on_stop()
-        else: # Manual sync mode
-             if is_manual_run:
-                  logger.info("Manual sync finished.")
-                  if not sync_after_id:
-                       sync_now_btn.config(state="normal")
+def load_schedule():
+    try:
+        schedule_state["auto_sync"], schedule_state["items"] = state_store.get_schedule()
+    except sqlite3.Error as e:
+        logger.warning(f"Could not load schedule from '{STATE_FILE}': {e}. Starting with a fresh schedule.")
+    return schedule_state
+
+def save_schedule():
+    try:
+        state_store.save_schedule(schedule_state["auto_sync"], schedule_state["items"])
+    except sqlite3.Error as e:
+        logger.error(f"Failed to save schedule to '{STATE_FILE}': {e}")
+
+def target_item_keys():
+    """Returns the linked item_ids that ACTUAL_TARGETS_FILE assigns targets to. Errors are reported by load_actual_targets."""
+    try:
+        with open(ACTUAL_TARGETS_FILE, "r") as f:
+            entries = json.load(f)
+        return {str(entry["item"]) for entry in entries if isinstance(entry, dict) and entry.get("item")}
+    except (IOError, ValueError, TypeError):
+        return set()
 
-        if not (is_manual_run and overall_success):
-             logger.info("Sync cycle finished.")
+def scheduled_items():
+    """
+    Returns {item_key: interval_hours} for every item auto-sync should run: the
+    primary item at the GUI interval, plus each linked item in the state store
+    that has Actual targets, at its own interval_hours (GUI interval if unset).
+    """
+    default_hours = max(1, interval_var.get())
+    items = {PRIMARY_ITEM_KEY: default_hours}
+    try:
+        linked = state_store.get_item_intervals()
+    except sqlite3.Error as e:
+        logger.error(f"Could not load linked items from '{STATE_FILE}': {e}")
+        linked = {}
+    with_targets = target_item_keys()
+    for item_key, interval_hours in linked.items():
+        if item_key in with_targets:
+            items[item_key] = max(1, interval_hours or default_hours)
+    return items
+
+def jittered(seconds):
+    """Spreads a delay by up to +/-SCHEDULE_JITTER_FRACTION so items don't fire in lockstep."""
+    spread = min(seconds * SCHEDULE_JITTER_FRACTION, SCHEDULE_MAX_JITTER_SECONDS)
+    return max(1.0, seconds + random.uniform(-spread, spread))
+
+def plan_schedule(now):
+    """
+    Sets each item's next run when auto-sync starts. New items are spread over
+    STARTUP_SPREAD_SECONDS; items whose runs were missed while the app was closed
+    or the machine slept get one coalesced catch-up run instead of one per miss.
+    """
+    for item_key, interval_hours in scheduled_items().items():
+        plan_item(item_key, interval_hours, now)
+
+def plan_item(item_key, interval_hours, now):
+    interval = interval_hours * 3600
+    entry = schedule_state["items"].setdefault(item_key, {"next_run": None, "last_run": None, "last_status": None, "failures": 0})
+    if entry.get("interval_hours") != interval_hours:
+        entry["interval_hours"] = interval_hours
+        entry["next_run"] = entry["last_run"] + interval if entry.get("last_run") else None
+
+    if entry["next_run"] is None:
+        entry["next_run"] = now + random.uniform(0, STARTUP_SPREAD_SECONDS)
+    elif entry["next_run"] < now:
+        missed = int((now - entry["next_run"]) // interval) + 1
+        logger.info(f"[{item_key}] Missed {missed} scheduled run(s); running one catch-up sync.")
+        entry["next_run"] = now + random.uniform(0, STARTUP_SPREAD_SECONDS)
+    else:
+        logger.info(f"[{item_key}] Next sync at {datetime.fromtimestamp(entry['next_run']):%Y-%m-%d %H:%M:%S}.")
+    entry["retry_count"] = 0
+
+def record_run_outcome(item_key, status, retry_count):
+    """Moves an item's next run forward: full interval on success, exponential backoff on failure."""
+    entry = schedule_state["items"][item_key]
+    now = time.time()
+    interval = entry["interval_hours"] * 3600
+    entry["retry_count"] = 0
+    if status == "retry":
+        entry["retry_count"] = retry_count + 1
+        entry["next_run"] = now + RETRY_DELAY_SECONDS
+    elif status == "success":
+        entry.update(last_run=now, last_status=status, failures=0, next_run=now + jittered(interval))
+        logger.info(f"[{item_key}] Next sync at {datetime.fromtimestamp(entry['next_run']):%Y-%m-%d %H:%M:%S}.")
+    else:
+        entry["failures"] = entry.get("failures", 0) + 1
+        backoff = min(BACKOFF_BASE_SECONDS * 2 ** (entry["failures"] - 1), interval)
+        entry.update(last_run=now, last_status=status, next_run=now + jittered(backoff))
+        logger.warning(f"[{item_key}] Sync failed ({entry['failures']} in a row). Backing off; retrying in {backoff / 60:.0f} minutes.")
+    save_schedule()
+
+def run_item_sync(item_key, is_manual_run, retry_count):
+    """Runs sync_transactions for one item; an unexpected exception counts as a failed run instead of escaping."""
+    try:
+        return sync_transactions(item_key, is_manual_run=is_manual_run, retry_count=retry_count)
+    except Exception as e:
+        logger.error(f"[{item_key}] Sync cycle crashed: {e}", exc_info=True)
+        return "failed"
 
+def scheduler_tick():
+    """
+    Runs every due item, then re-arms itself for the next due time (at most
+    SCHEDULER_TICK_SECONDS away). The tick is re-armed even if something here
+    raises, so auto-sync never stops silently while the GUI shows it running.
+    """
+    global sync_after_id
+    items = schedule_state["items"]
+    due_items = {}
+    try:
+        due_items = scheduled_items()
+        for item_key, interval_hours in due_items.items():
+            if item_key not in items: # Linked (or given targets) while auto-sync was running
+                plan_item(item_key, interval_hours, time.time())
+        for item_key in sorted(due_items, key=lambda key: items[key]["next_run"]):
+            if not sync_after_id:
+                return # Auto-sync was stopped during a run
+            if items[item_key]["next_run"] <= time.time():
+                retry_count = items[item_key].get("retry_count", 0)
+                status = run_item_sync(item_key, is_manual_run=False, retry_count=retry_count)
+                record_run_outcome(item_key, status, retry_count)
+    except Exception as e:
+        logger.error(f"Scheduler tick failed: {e}", exc_info=True)
+    finally:
+        if sync_after_id:
+            next_runs = [items[key]["next_run"] for key in due_items if items.get(key, {}).get("next_run") is not None]
+            delay = min(max(min(next_runs) - time.time(), 1), SCHEDULER_TICK_SECONDS) if next_runs else SCHEDULER_TICK_SECONDS
+            sync_after_id = root.after(int(delay * 1000), scheduler_tick)
 
 # ------------------------------------------------------------------------------
-# 8. Handlers for GUI buttons
+# 12. Handlers for GUI buttons
 # ------------------------------------------------------------------------------
 
 def set_config_state(state):
@@ -753,21 +2023,29 @@ def on_start():
         logger.warning("Auto-sync is already running.")
         return
     logger.info("Starting automatic synchronization...")
+    start_link_service(when_configured=True) # Credentials may have been entered since startup
+    load_schedule()
+    plan_schedule(time.time())
+    schedule_state["auto_sync"] = True
+    save_schedule()
     set_config_state("disabled")
     start_btn.config(state="disabled")
     stop_btn.config(state="normal")
     sync_now_btn.config(state="disabled")
     launch_link_btn.config(state="disabled")
-    sync_after_id = root.after(100, lambda: sync_transactions(is_manual_run=False, retry_count=0))
+    sync_after_id = root.after(100, scheduler_tick)
 
-def on_stop():
-    """Stop automatic background synchronization."""
+def on_stop(persist=True):
+    """Stop automatic background synchronization. With persist=False, auto-sync resumes on next launch."""
     global sync_after_id
     if sync_after_id:
         logger.info("Stopping automatic synchronization...")
         try: root.after_cancel(sync_after_id)
         except ValueError: logger.debug("No active sync task found to cancel.")
         sync_after_id = None
+        if persist:
+            schedule_state["auto_sync"] = False
+            save_schedule()
         set_config_state("normal")
         start_btn.config(state="normal")
         stop_btn.config(state="disabled")
@@ -784,7 +2062,32 @@ def on_sync_now():
         return
     logger.info("Manual sync requested.")
     sync_now_btn.config(state="disabled")
-    root.after(100, lambda: sync_transactions(is_manual_run=True, retry_count=0))
+    root.after(100, run_manual_sync)
+
+def run_manual_sync(item_keys=None, retry_count=0):
+    """
+    Syncs every scheduled item once, one per main-loop turn, retrying pagination
+    errors after RETRY_DELAY_SECONDS. Sync Now is re-enabled when the last item
+    finishes, even if a run raised.
+    """
+    continued = False
+    try:
+        if item_keys is None:
+            item_keys = list(scheduled_items())
+        status = run_item_sync(item_keys[0], is_manual_run=True, retry_count=retry_count)
+        if status == "retry":
+            root.after(RETRY_DELAY_SECONDS * 1000, lambda: run_manual_sync(item_keys, retry_count + 1))
+            continued = True
+        elif len(item_keys) > 1:
+            root.after(100, lambda: run_manual_sync(item_keys[1:]))
+            continued = True
+    except Exception as e:
+        logger.error(f"Manual sync failed: {e}", exc_info=True)
+    finally:
+        if not continued:
+            logger.info("Manual sync finished.")
+            if not sync_after_id:
+                sync_now_btn.config(state="normal")
 
 launch_link_btn.config(command=launch_plaid_link)
 start_btn.config(command=on_start)
@@ -792,13 +2095,13 @@ stop_btn.config(command=on_stop)
 sync_now_btn.config(command=on_sync_now)
 
 # ------------------------------------------------------------------------------
-# 9. Graceful Exit & Start Main Loop
+# 13. Graceful Exit & Start Main Loop
 # ------------------------------------------------------------------------------
 
 def on_closing():
     """Handle window closing event."""
     logger.info("Close requested. Stopping sync if running...")
-    if sync_after_id: on_stop()
+    if sync_after_id: on_stop(persist=False) # Keep auto-sync enabled for the next launch
     logger.info("Exiting application.")
     root.destroy()
 
@@ -807,6 +2110,10 @@ root.protocol("WM_DELETE_WINDOW", on_closing)
 try:
     current_time_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     logger.info(f"Application started ({current_time_str}). Fill details, use Link if needed, then Start/Sync.")
+    start_link_service(when_configured=True)
+    if load_schedule()["auto_sync"]:
+        logger.info("Auto-sync was running when the application last closed. Resuming it.")
+        root.after(500, on_start)
     root.mainloop()
 except KeyboardInterrupt:
     logger.info("Keyboard interrupt received. Exiting.")
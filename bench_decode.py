@@ -0,0 +1,119 @@
+"""
+Decode benchmark for Plaid /transactions/sync pages.
+
+Compares per-page CPU and peak allocations of the Plaid client's model
+to_dict() path with the slim raw-JSON decoder used by Actualbudgetsync.py.
+Run it with: python bench_decode.py [txn_count] [rounds]
+
+Actualbudgetsync.py builds its GUI and state store at import time, so the
+decoder is loaded from its source rather than imported.
+"""
+import ast
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from plaid import Configuration, Environment, ApiClient
+from plaid.model.transactions_sync_response import TransactionsSyncResponse
+
+# Optional fast JSON decoder, matching the app's fallback
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Actualbudgetsync.py")
+DECODER_NAMES = ("SLIM_TXN_FIELDS", "slim_transaction", "decode_transactions_sync_page")
+
+def load_decoder():
+    """Compiles only the decoder definitions from the app and returns decode_transactions_sync_page."""
+    with open(APP_FILE, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=APP_FILE)
+    wanted = []
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name in DECODER_NAMES:
+            wanted.append(node)
+        elif isinstance(node, ast.Assign) and any(getattr(t, "id", None) in DECODER_NAMES for t in node.targets):
+            wanted.append(node)
+    namespace = {"_json_loads": _json_loads}
+    exec(compile(ast.Module(body=wanted, type_ignores=[]), APP_FILE, "exec"), namespace)
+    return namespace["decode_transactions_sync_page"]
+
+def _synthetic_sync_page(txn_count):
+    """Builds a realistic /transactions/sync body with fully populated nested fields."""
+    def txn(i):
+        return {
+            "transaction_id": f"txn_{i:08d}", "account_id": "acct_bench", "pending_transaction_id": None,
+            "amount": round(12.34 + i % 500, 2), "iso_currency_code": "USD", "unofficial_currency_code": None,
+            "date": "2024-03-15", "authorized_date": "2024-03-14", "datetime": None, "authorized_datetime": None,
+            "name": f"POS PURCHASE {i} COFFEE SHOP", "merchant_name": "Coffee Shop", "merchant_entity_id": "ent_123",
+            "logo_url": "https://plaid-merchant-logos.plaid.com/coffee.png", "website": "coffee.example.com",
+            "original_description": None, "account_owner": None, "pending": False,
+            "payment_channel": "in store", "transaction_type": "place", "transaction_code": None,
+            "category": ["Food and Drink", "Restaurants", "Coffee Shop"], "category_id": "13005043",
+            "check_number": None,
+            "location": {"address": "123 Main St", "city": "San Francisco", "region": "CA", "postal_code": "94105",
+                         "country": "US", "lat": 37.7749, "lon": -122.4194, "store_number": "1234"},
+            "payment_meta": {"by_order_of": None, "payee": None, "payer": None, "payment_method": None,
+                             "payment_processor": None, "ppd_id": None, "reason": None, "reference_number": None},
+            "personal_finance_category": {"primary": "FOOD_AND_DRINK", "detailed": "FOOD_AND_DRINK_COFFEE",
+                                          "confidence_level": "VERY_HIGH"},
+            "personal_finance_category_icon_url": "https://plaid-category-icons.plaid.com/PFC_FOOD_AND_DRINK.png",
+            "counterparties": [{"name": "Coffee Shop", "type": "merchant", "entity_id": "ent_123",
+                                "logo_url": None, "website": "coffee.example.com", "confidence_level": "VERY_HIGH"}],
+        }
+    body = {
+        "added": [txn(i) for i in range(txn_count)],
+        "modified": [txn(txn_count + i) for i in range(txn_count // 10)],
+        "removed": [{"transaction_id": f"txn_removed_{i}", "account_id": "acct_bench"} for i in range(txn_count // 20)],
+        "accounts": [], "has_more": False, "next_cursor": "bench_cursor", "request_id": "bench",
+        "transactions_update_status": "HISTORICAL_UPDATE_COMPLETE",
+    }
+    return json.dumps(body).encode("utf-8")
+
+class _RawBenchResponse:
+    """Minimal stand-in for the REST response object ApiClient.deserialize expects."""
+    def __init__(self, data):
+        self.data = data
+    def getheader(self, name, default=None):
+        return "application/json; charset=utf-8" if name.lower() == "content-type" else default
+
+def _measure(func, raw_body, rounds):
+    """CPU per page from an untraced pass, then peak allocations from a separate traced pass."""
+    func(raw_body) # Warm-up so one-time imports and caches don't count
+    cpu_start = time.process_time()
+    for _ in range(rounds):
+        func(raw_body)
+    cpu_per_page = (time.process_time() - cpu_start) / rounds
+
+    tracemalloc.start()
+    func(raw_body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_per_page, peak
+
+def run_decode_benchmark(txn_count=500, rounds=5):
+    """Compares per-page CPU and peak allocations of model to_dict() vs the slim decode path."""
+    decode_transactions_sync_page = load_decoder()
+    api_client = ApiClient(Configuration(host=Environment.Sandbox))
+    raw_body = _synthetic_sync_page(txn_count)
+
+    def model_decode(body):
+        model = api_client.deserialize(_RawBenchResponse(body), (TransactionsSyncResponse,), True)
+        return model.to_dict()
+
+    results = [("model to_dict()", _measure(model_decode, raw_body, rounds)),
+               (f"slim ({'orjson' if orjson else 'json'})", _measure(decode_transactions_sync_page, raw_body, rounds))]
+    print(f"Decode benchmark: {len(raw_body) / 1024:.0f} KiB page, {txn_count} added, {rounds} rounds")
+    for label, (cpu, peak) in results:
+        print(f"  {label:<20} {cpu * 1000:9.2f} ms CPU/page  {peak / 1024:9.0f} KiB peak alloc")
+    base_cpu, base_peak = results[0][1]
+    slim_cpu, slim_peak = results[1][1]
+    print(f"  speedup: {base_cpu / max(slim_cpu, 1e-9):.1f}x CPU, {base_peak / max(slim_peak, 1):.1f}x less peak memory")
+
+if __name__ == "__main__":
+    run_decode_benchmark(*(int(arg) for arg in sys.argv[1:3]))